@@ -76,6 +76,9 @@ def serialize(A):
     object, if possible.
     """
     if isinstance(A, str):
+        return (0, A.encode('utf-8'))
+
+    if isinstance(A, bytes):
         return (0, A)
 
     if isinstance(A, numpy.ndarray):
@@ -89,11 +92,11 @@ def serialize(A):
 
         if A.flags['C_CONTIGUOUS']:
             # great, just use the array's buffer interface
-            return (ft, A.tostring())
+            return (ft, A.tobytes())
 
         # otherwise, we need a copy to C order
         AC = A.copy('C')
-        return (ft, AC.tostring())
+        return (ft, AC.tobytes())
 
     if isinstance(A, int):
         return (DATATYPE_INT32, struct.pack('i', A))
@@ -196,13 +199,13 @@ class Event:
         if type_type == DATATYPE_UNKNOWN:
             return None
         type_size = len(type_buf)
-        type_numel = type_size / wordSize[type_type]
+        type_numel = type_size // wordSize[type_type]
 
         value_type, value_buf = serialize(self.value)
         if value_type == DATATYPE_UNKNOWN:
             return None
         value_size = len(value_buf)
-        value_numel = value_size / wordSize[value_type]
+        value_numel = value_size // wordSize[value_type]
 
         bufsize = type_size + value_size
 
@@ -219,6 +222,9 @@ class Client:
     def __init__(self):
         self.isConnected = False
         self.sock = []
+        # reusable receive buffers, responses are read into them with recv_into
+        self.respHdr = bytearray(8)
+        self.respBuf = bytearray(0)
 
     def connect(self, hostname, port=1972):
         """
@@ -255,26 +261,39 @@ class Client:
                 'HHI', VERSION, command, len(payload)) + payload
         self.sendRaw(request)
 
+    def receiveInto(self, view):
+        """Receive exactly len(view) bytes from the socket into the given memoryview."""
+        N = len(view)
+        nr = 0
+        while nr < N:
+            n = self.sock.recv_into(view[nr:], N - nr)
+            if n == 0:
+                self.disconnect()
+                raise IOError('Connection closed by buffer server')
+            nr += n
+
     def receiveResponse(self, minBytes=0):
         """
         Receive response from server on socket 's' and return it as
-        (status,bufsize,payload).
+        (status,bufsize,payload). The payload is a memoryview on a receive
+        buffer that gets reused by the next request.
         """
 
-        resp_hdr = self.sock.recv(8)
-        while len(resp_hdr) < 8:
-            resp_hdr += self.sock.recv(8 - len(resp_hdr))
+        self.receiveInto(memoryview(self.respHdr))
 
-        (version, command, bufsize) = struct.unpack('HHI', resp_hdr)
+        (version, command, bufsize) = struct.unpack('HHI', self.respHdr)
 
         if version != VERSION:
             self.disconnect()
             raise IOError('Bad response from buffer server - disconnecting')
 
         if bufsize > 0:
-            payload = self.sock.recv(bufsize)
-            while len(payload) < bufsize:
-                payload += self.sock.recv(bufsize - len(payload))
+            if bufsize > len(self.respBuf):
+                # arrays returned by getData may still refer to the old buffer,
+                # so it is replaced instead of resized
+                self.respBuf = bytearray(bufsize)
+            payload = memoryview(self.respBuf)[:bufsize]
+            self.receiveInto(payload)
         else:
             payload = None
         return (command, bufsize, payload)
@@ -300,78 +319,17 @@ class Client:
             raise IOError('Invalid HEADER packet received (too few bytes) - '
                           'disconnecting')
 
-        (nchans, nsamp, nevt, fsamp, dtype,
-         bfsiz) = struct.unpack('IIIfII', payload[0:24])
-
-        H = Header()
-        H.nChannels = nchans
-        H.nSamples = nsamp
-        H.nEvents = nevt
-        H.fSample = fsamp
-        H.dataType = dtype
-
-        if bfsiz > 0:
-            offset = 24
-            while offset + 8 < bufsize:
-                (chunk_type, chunk_len) = struct.unpack(
-                    'II', payload[offset:offset + 8])
-                offset += 8
-                if offset + chunk_len > bufsize:
-                    break
-                H.chunks[chunk_type] = payload[offset:offset + chunk_len]
-                offset += chunk_len
-
-            if CHUNK_CHANNEL_NAMES in H.chunks:
-                L = H.chunks[CHUNK_CHANNEL_NAMES].split(b'\0')
-                numLab = len(L)
-                if numLab >= H.nChannels:
-                    H.labels = [x.decode('utf-8') for x in L[0:H.nChannels]]
-
-        return H
+        return unpackHeader(payload, bufsize)
 
     def putHeader(self, nChannels, fSample, dataType, labels=None,
                   chunks=None, reponse=True):
-        haveLabels = False
-        extras = b''
-
-        if (type(labels)==list) and (len(labels)==0):
-            labels=None
-
-        if not(labels is None):
-            serLabels = b''
-            for n in range(0, nChannels):
-                # ensure that labels are ascii strings, not unicode
-                serLabels += labels[n].encode('ascii', 'ignore') + b'\0'
-            try:
-                pass
-            except:
-                raise ValueError('Channels names (labels), if given,'
-                                 ' must be a list of N=numChannels strings')
-
-            extras = struct.pack('II', CHUNK_CHANNEL_NAMES,
-                                 len(serLabels)) + serLabels
-            haveLabels = True
-
-        if not(chunks is None):
-            for chunk_type, chunk_data in chunks:
-                if haveLabels and chunk_type == CHUNK_CHANNEL_NAMES:
-                    # ignore channel names chunk in case we got labels
-                    continue
-                extras += struct.pack('II', chunk_type,
-                                      len(chunk_data)) + chunk_data
-
-        sizeChunks = len(extras)
-
         if reponse:
             command = PUT_HDR
         else:
             command = PUT_HDR_NORESPONSE
 
-        hdef = struct.pack('IIIfII', nChannels, 0, 0,
-                           fSample, dataType, sizeChunks)
-        request = struct.pack('HHI', VERSION, command,
-                              sizeChunks + len(hdef)) + hdef + extras
-        self.sendRaw(request)
+        self.sendRequest(command, packHeader(nChannels, fSample, dataType,
+                                             labels, chunks))
 
         if reponse:
             (status, bufsize, resp_buf) = self.receiveResponse()
@@ -384,15 +342,11 @@ class Client:
         Numpy array, samples in rows(!). The 'indices' argument is optional,
         and if given, must be a tuple or list with inclusive, zero-based
         start/end indices.
+        The array is built directly on the receive buffer without copying,
+        its contents are only valid until the next request on this client.
         """
 
-        if index is None:
-            request = struct.pack('HHI', VERSION, GET_DAT, 0)
-        else:
-            indS = int(index[0])
-            indE = int(index[1])
-            request = struct.pack('HHIII', VERSION, GET_DAT, 8, indS, indE)
-        self.sendRaw(request)
+        self.sendRaw(packRangeRequest(GET_DAT, index))
 
         (status, bufsize, payload) = self.receiveResponse()
         if status == GET_ERR:
@@ -406,15 +360,7 @@ class Client:
             self.disconnect()
             raise IOError('Invalid DATA packet received (too few bytes)')
 
-        (nchans, nsamp, datype, bfsiz) = struct.unpack('IIII', payload[0:16])
-
-        if bfsiz < bufsize - 16 or datype >= len(numpyType):
-            raise IOError('Invalid DATA packet received')
-
-        raw = payload[16:bfsiz + 16]
-        D = numpy.ndarray((nsamp, nchans), dtype=numpyType[datype], buffer=raw)
-
-        return D
+        return unpackData(payload, bufsize)
 
     def getEvents(self, index=None):
         """
@@ -425,13 +371,7 @@ class Client:
         or Numpy arrays.
         """
 
-        if index is None:
-            request = struct.pack('HHI', VERSION, GET_EVT, 0)
-        else:
-            indS = int(index[0])
-            indE = int(index[1])
-            request = struct.pack('HHIII', VERSION, GET_EVT, 8, indS, indE)
-        self.sendRaw(request)
+        self.sendRaw(packRangeRequest(GET_EVT, index))
 
         (status, bufsize, resp_buf) = self.receiveResponse()
         if status == GET_ERR:
@@ -441,17 +381,8 @@ class Client:
             self.disconnect()
             raise IOError('Bad response from buffer server - disconnecting')
 
-        offset = 0
-        E = []
-        while 1:
-            e = Event()
-            nextOffset = e.deserialize(resp_buf[offset:])
-            if nextOffset == 0:
-                break
-            E.append(e)
-            offset = offset + nextOffset
-
-        return E
+        # events keep references to parts of the payload
+        return unpackEvents(bytes(resp_buf) if resp_buf is not None else b'')
 
     def putEvents(self, E, reponse=True):
         """
@@ -459,16 +390,7 @@ class Client:
         whether an 'Event' object, or a list of 'Event' objects is
         given as an argument.
         """
-        if isinstance(E, Event):
-            buf = E.serialize()
-        else:
-            buf = ''
-            num = 0
-            for e in E:
-                if not(isinstance(e, Event)):
-                    raise 'Element %i in given list is not an Event' % num
-                buf = buf + e.serialize()
-                num = num + 1
+        buf = packEvents(E)
 
         if reponse:
             command = PUT_EVT
@@ -490,25 +412,12 @@ class Client:
         buffer.
         """
 
-        if not(isinstance(D, numpy.ndarray)) or len(D.shape) != 2:
-            raise ValueError(
-                'Data must be given as a NUMPY array (samples x channels)')
-
-        nSamp = D.shape[0]
-        nChan = D.shape[1]
-
-        (dataType, dataBuf) = serialize(D)
-
-        dataBufSize = len(dataBuf)
-
         if response:
             command = PUT_DAT
         else:
             command = PUT_DAT_NORESPONSE
 
-        request = struct.pack('HHI', VERSION, command, 16 + dataBufSize)
-        dataDef = struct.pack('IIII', nChan, nSamp, dataType, dataBufSize)
-        self.sendRaw(request + dataDef + dataBuf)
+        self.sendRequest(command, packData(D))
 
         if response:
             (status, bufsize, resp_buf) = self.receiveResponse()
@@ -516,9 +425,7 @@ class Client:
                 raise IOError('Samples could not be written.')
 
     def poll(self):
-
-        request = struct.pack('HHIIII', VERSION, WAIT_DAT, 12, 0, 0, 0)
-        self.sendRaw(request)
+        self.sendRaw(packWaitRequest(0, 0, 0))
 
         (status, bufsize, resp_buf) = self.receiveResponse()
 
@@ -528,9 +435,7 @@ class Client:
         return struct.unpack('II', resp_buf[0:8])
 
     def wait(self, nsamples, nevents, timeout):
-        request = struct.pack('HHIIII', VERSION, WAIT_DAT,
-                              12, int(nsamples), int(nevents), int(timeout))
-        self.sendRaw(request)
+        self.sendRaw(packWaitRequest(nsamples, nevents, timeout))
 
         (status, bufsize, resp_buf) = self.receiveResponse()
 
@@ -539,6 +444,165 @@ class Client:
 
         return struct.unpack('II', resp_buf[0:8])
 
+
+def packHeader(nChannels, fSample, dataType, labels=None, chunks=None):
+    """
+    Returns the payload of a PUT_HDR request for the given header
+    information.
+    """
+    haveLabels = False
+    extras = b''
+
+    if (type(labels)==list) and (len(labels)==0):
+        labels=None
+
+    if not(labels is None):
+        serLabels = b''
+        try:
+            for n in range(0, nChannels):
+                # ensure that labels are ascii strings, not unicode
+                serLabels += labels[n].encode('ascii', 'ignore') + b'\0'
+        except:
+            raise ValueError('Channels names (labels), if given,'
+                             ' must be a list of N=numChannels strings')
+
+        extras = struct.pack('II', CHUNK_CHANNEL_NAMES,
+                             len(serLabels)) + serLabels
+        haveLabels = True
+
+    if not(chunks is None):
+        for chunk_type, chunk_data in chunks:
+            if haveLabels and chunk_type == CHUNK_CHANNEL_NAMES:
+                # ignore channel names chunk in case we got labels
+                continue
+            extras += struct.pack('II', chunk_type,
+                                  len(chunk_data)) + chunk_data
+
+    sizeChunks = len(extras)
+
+    hdef = struct.pack('IIIfII', nChannels, 0, 0,
+                       fSample, dataType, sizeChunks)
+    return hdef + extras
+
+
+def unpackHeader(payload, bufsize):
+    """
+    Returns a Header object from the payload of a GET_HDR response, which
+    must hold at least 24 bytes.
+    """
+    (nchans, nsamp, nevt, fsamp, dtype,
+     bfsiz) = struct.unpack('IIIfII', payload[0:24])
+
+    H = Header()
+    H.nChannels = nchans
+    H.nSamples = nsamp
+    H.nEvents = nevt
+    H.fSample = fsamp
+    H.dataType = dtype
+
+    if bfsiz > 0:
+        offset = 24
+        while offset + 8 < bufsize:
+            (chunk_type, chunk_len) = struct.unpack(
+                'II', payload[offset:offset + 8])
+            offset += 8
+            if offset + chunk_len > bufsize:
+                break
+            H.chunks[chunk_type] = bytes(payload[offset:offset + chunk_len])
+            offset += chunk_len
+
+        if CHUNK_CHANNEL_NAMES in H.chunks:
+            L = H.chunks[CHUNK_CHANNEL_NAMES].split(b'\0')
+            numLab = len(L)
+            if numLab >= H.nChannels:
+                H.labels = [x.decode('utf-8') for x in L[0:H.nChannels]]
+
+    return H
+
+
+def packRangeRequest(command, index=None):
+    """
+    Returns a GET_DAT or GET_EVT request, optionally restricted to the
+    inclusive, zero-based start/end indices in 'index'.
+    """
+    if index is None:
+        return struct.pack('HHI', VERSION, command, 0)
+    indS = int(index[0])
+    indE = int(index[1])
+    return struct.pack('HHIII', VERSION, command, 8, indS, indE)
+
+
+def packData(D):
+    """
+    Returns the payload of a PUT_DAT request for the NUMPY array D
+    (samples x channels).
+    """
+    if not(isinstance(D, numpy.ndarray)) or len(D.shape) != 2:
+        raise ValueError(
+            'Data must be given as a NUMPY array (samples x channels)')
+
+    nSamp = D.shape[0]
+    nChan = D.shape[1]
+
+    (dataType, dataBuf) = serialize(D)
+
+    dataDef = struct.pack('IIII', nChan, nSamp, dataType, len(dataBuf))
+    return dataDef + dataBuf
+
+
+def unpackData(payload, bufsize):
+    """
+    Returns the samples in the payload of a GET_DAT response as a Numpy
+    array on the same memory, samples in rows.
+    """
+    (nchans, nsamp, datype, bfsiz) = struct.unpack('IIII', payload[0:16])
+
+    if bfsiz < bufsize - 16 or datype >= len(numpyType):
+        raise IOError('Invalid DATA packet received')
+
+    raw = payload[16:bfsiz + 16]
+    return numpy.ndarray((nsamp, nchans), dtype=numpyType[datype], buffer=raw)
+
+
+def packEvents(E):
+    """
+    Returns the payload of a PUT_EVT request for a single 'Event' object
+    or a list of them.
+    """
+    if isinstance(E, Event):
+        return E.serialize()
+
+    buf = b''
+    num = 0
+    for e in E:
+        if not(isinstance(e, Event)):
+            raise ValueError('Element %i in given list is not an Event' % num)
+        buf = buf + e.serialize()
+        num = num + 1
+    return buf
+
+
+def unpackEvents(buf):
+    """Returns the list of events in the payload of a GET_EVT response."""
+    offset = 0
+    E = []
+    while 1:
+        e = Event()
+        nextOffset = e.deserialize(buf[offset:])
+        if nextOffset == 0:
+            break
+        E.append(e)
+        offset = offset + nextOffset
+
+    return E
+
+
+def packWaitRequest(nsamples, nevents, timeout):
+    """Returns a WAIT_DAT request with the given thresholds and timeout."""
+    return struct.pack('HHIIII', VERSION, WAIT_DAT, 12, int(nsamples),
+                       int(nevents), int(timeout))
+
+
 if __name__ == "__main__":
     # Just a small demo for testing purposes...
     # This should be moved to a separate file at some point
@@ -0,0 +1,199 @@
+"""
+asyncio client for the FieldTrip buffer (V1), alongside the blocking
+FieldTrip.Client. Uses the same request/response encoding.
+"""
+
+import asyncio
+import struct
+
+from FieldTrip import (VERSION, PUT_HDR, PUT_DAT, PUT_EVT, PUT_OK, GET_HDR,
+                       GET_DAT, GET_EVT, GET_OK, GET_ERR, WAIT_OK,
+                       PUT_HDR_NORESPONSE, PUT_DAT_NORESPONSE,
+                       PUT_EVT_NORESPONSE, packHeader, unpackHeader,
+                       packRangeRequest, packData, unpackData, packEvents,
+                       unpackEvents, packWaitRequest)
+
+
+class Client:
+
+    """
+    Class for managing a non-blocking client connection to a FieldTrip
+    buffer. All requests are coroutines; requests issued concurrently on the
+    same client are sent one after another.
+    """
+
+    def __init__(self):
+        self.isConnected = False
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+
+    async def connect(self, hostname, port=1972):
+        """
+        connect(hostname [, port]) -- make a connection, default port is
+        1972.
+        """
+        self.reader, self.writer = await asyncio.open_connection(hostname,
+                                                                 port)
+        self.isConnected = True
+
+    async def disconnect(self):
+        """disconnect() -- close a connection."""
+        if self.isConnected:
+            self.isConnected = False
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+            self.reader = None
+            self.writer = None
+
+    async def request(self, request, response=True):
+        """
+        Send the complete request and return the response as
+        (status, bufsize, payload), or None if no response is expected.
+        """
+        if not(self.isConnected):
+            raise IOError('Not connected to FieldTrip buffer')
+
+        async with self.lock:
+            self.writer.write(request)
+            await self.writer.drain()
+            if not response:
+                return None
+
+            try:
+                resp_hdr = await self.reader.readexactly(8)
+                (version, command, bufsize) = struct.unpack('HHI', resp_hdr)
+                if version != VERSION:
+                    await self.disconnect()
+                    raise IOError('Bad response from buffer server - '
+                                  'disconnecting')
+                payload = None
+                if bufsize > 0:
+                    payload = await self.reader.readexactly(bufsize)
+            except asyncio.IncompleteReadError:
+                await self.disconnect()
+                raise IOError('Connection closed by buffer server')
+        return (command, bufsize, payload)
+
+    async def sendRequest(self, command, payload=None, response=True):
+        if payload is None:
+            payload = b''
+        return await self.request(struct.pack('HHI', VERSION, command,
+                                              len(payload)) + payload,
+                                  response)
+
+    async def getHeader(self):
+        """
+        getHeader() -- grabs header information from the buffer an returns
+        it as a Header object, or None if there is no header.
+        """
+        (status, bufsize, payload) = await self.sendRequest(GET_HDR)
+
+        if status == GET_ERR:
+            return None
+
+        if status != GET_OK:
+            await self.disconnect()
+            raise IOError('Bad response from buffer server - disconnecting')
+
+        if bufsize < 24:
+            await self.disconnect()
+            raise IOError('Invalid HEADER packet received (too few bytes) - '
+                          'disconnecting')
+
+        return unpackHeader(payload, bufsize)
+
+    async def putHeader(self, nChannels, fSample, dataType, labels=None,
+                        chunks=None, reponse=True):
+        command = PUT_HDR if reponse else PUT_HDR_NORESPONSE
+        resp = await self.sendRequest(command,
+                                      packHeader(nChannels, fSample, dataType,
+                                                 labels, chunks), reponse)
+        if reponse and resp[0] != PUT_OK:
+            raise IOError('Header could not be written')
+
+    async def getData(self, index=None):
+        """
+        getData([indices]) -- retrieve data samples and return them as a
+        Numpy array, samples in rows(!). The 'indices' argument is optional,
+        and if given, must be a tuple or list with inclusive, zero-based
+        start/end indices.
+        """
+        (status, bufsize, payload) = await self.request(
+            packRangeRequest(GET_DAT, index))
+
+        if status == GET_ERR:
+            return None
+
+        if status != GET_OK:
+            await self.disconnect()
+            raise IOError('Bad response from buffer server - disconnecting')
+
+        if bufsize < 16:
+            await self.disconnect()
+            raise IOError('Invalid DATA packet received (too few bytes)')
+
+        return unpackData(payload, bufsize)
+
+    async def putData(self, D, response=True):
+        """
+        putData(D) -- writes samples that must be given as a NUMPY array,
+        samples x channels.
+        """
+        command = PUT_DAT if response else PUT_DAT_NORESPONSE
+        resp = await self.sendRequest(command, packData(D), response)
+        if response and resp[0] != PUT_OK:
+            raise IOError('Samples could not be written.')
+
+    async def getEvents(self, index=None):
+        """
+        getEvents([indices]) -- retrieve events and return them as a list
+        of Event objects. The 'indices' argument is optional, and if given,
+        must be a tuple or list with inclusive, zero-based start/end indices.
+        """
+        (status, bufsize, payload) = await self.request(
+            packRangeRequest(GET_EVT, index))
+
+        if status == GET_ERR:
+            return []
+
+        if status != GET_OK:
+            await self.disconnect()
+            raise IOError('Bad response from buffer server - disconnecting')
+
+        return unpackEvents(payload if payload is not None else b'')
+
+    async def putEvents(self, E, reponse=True):
+        """
+        putEvents(E) -- writes a single 'Event' object or a list of them.
+        """
+        command = PUT_EVT if reponse else PUT_EVT_NORESPONSE
+        resp = await self.sendRequest(command, packEvents(E), reponse)
+        if reponse and resp[0] != PUT_OK:
+            raise IOError('Events could not be written.')
+
+    async def poll(self):
+        (status, bufsize, payload) = await self.request(
+            packWaitRequest(0, 0, 0))
+
+        if status != WAIT_OK or bufsize < 8:
+            raise IOError('Polling failed.')
+
+        return struct.unpack('II', payload[0:8])
+
+    async def wait(self, nsamples, nevents, timeout):
+        """
+        wait(nsamples, nevents, timeout) -- waits until the buffer holds more
+        than nsamples samples or nevents events, or timeout ms have passed.
+        Other coroutines keep running in the meantime.
+        """
+        (status, bufsize, payload) = await self.request(
+            packWaitRequest(nsamples, nevents, timeout))
+
+        if status != WAIT_OK or bufsize < 8:
+            raise IOError('Wait request failed.')
+
+        return struct.unpack('II', payload[0:8])
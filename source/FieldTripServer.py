@@ -0,0 +1,317 @@
+import collections
+import socket
+import socketserver
+import struct
+import threading
+
+import numpy as np
+
+from buffers import SampleBuffer
+from FieldTrip import (VERSION, PUT_HDR, PUT_DAT, PUT_EVT, PUT_OK, PUT_ERR, GET_HDR, GET_DAT, GET_EVT, GET_OK,
+                       GET_ERR, FLUSH_HDR, FLUSH_DAT, FLUSH_EVT, FLUSH_OK, FLUSH_ERR, WAIT_DAT, WAIT_OK, WAIT_ERR,
+                       PUT_HDR_NORESPONSE, PUT_DAT_NORESPONSE, PUT_EVT_NORESPONSE, numpyType, wordSize)
+
+"""
+FieldTrip buffer (V1) server in pure Python, a stand-in for demo_buffer.exe or the buffer of an EEG amplifier.
+Speaks the protocol of FieldTrip.Client: PUT_HDR, GET_HDR, PUT_DAT, GET_DAT, PUT_EVT, GET_EVT, FLUSH_* and WAIT_DAT.
+Only the latest samples and events are kept in bounded ring buffers.
+Usage: python FieldTripServer.py [port] [capacity]
+Author: Edward Berndt
+"""
+
+MESSAGE_FORMAT = 'HHI'
+MESSAGE_SIZE = struct.calcsize(MESSAGE_FORMAT)
+HEADER_DEF_FORMAT = 'IIIfII'
+HEADER_DEF_SIZE = struct.calcsize(HEADER_DEF_FORMAT)
+DATA_DEF_FORMAT = 'IIII'
+DATA_DEF_SIZE = struct.calcsize(DATA_DEF_FORMAT)
+EVENT_DEF_FORMAT = 'IIIIIiiI'
+EVENT_DEF_SIZE = struct.calcsize(EVENT_DEF_FORMAT)
+
+
+class BufferState:
+    """
+    Header, samples and events of the buffer, shared by all connections.
+    Every access has to hold the condition, which is notified whenever samples or events are added.
+    """
+
+    def __init__(self, capacity=100000, max_events=10000):
+        """
+        :param capacity: maximum number of samples that are kept
+        :param max_events: maximum number of events that are kept
+        """
+        self.capacity = capacity
+        self.condition = threading.Condition()
+        self.header = None
+        self.chunks = b''
+        self.samples = None
+        self.events = collections.deque(maxlen=max_events)
+        self.n_events = 0
+
+    def put_header(self, payload):
+        n_channels, _, _, fsample, data_type, size_chunks = struct.unpack_from(HEADER_DEF_FORMAT, payload)
+        if n_channels == 0 or data_type >= len(numpyType) or HEADER_DEF_SIZE + size_chunks > len(payload):
+            return False
+        with self.condition:
+            # a new header starts a new recording
+            self.header = (n_channels, fsample, data_type)
+            self.chunks = bytes(payload[HEADER_DEF_SIZE:HEADER_DEF_SIZE + size_chunks])
+            self.samples = SampleBuffer(self.capacity, n_channels)
+            self.events.clear()
+            self.n_events = 0
+            self.condition.notify_all()
+        return True
+
+    def get_header(self):
+        with self.condition:
+            if self.header is None:
+                return None
+            n_channels, fsample, data_type = self.header
+            return struct.pack(HEADER_DEF_FORMAT, n_channels, self.samples.n_appended, self.n_events,
+                               fsample, data_type, len(self.chunks)) + self.chunks
+
+    def put_data(self, payload):
+        n_channels, n_samples, data_type, size = struct.unpack_from(DATA_DEF_FORMAT, payload)
+        with self.condition:
+            if self.header is None or n_channels != self.header[0] or data_type != self.header[2]:
+                return False
+            if size != n_samples * n_channels * wordSize[data_type] or DATA_DEF_SIZE + size > len(payload):
+                return False
+            samples = np.frombuffer(payload, dtype=numpyType[data_type], count=n_samples * n_channels,
+                                    offset=DATA_DEF_SIZE).reshape(n_samples, n_channels)
+            self.samples.append(samples)
+            self.condition.notify_all()
+        return True
+
+    def get_data(self, index=None):
+        with self.condition:
+            if self.header is None:
+                return None
+            n_total = self.samples.n_appended
+            first, last = (n_total - len(self.samples), n_total - 1) if index is None else index
+            if first < n_total - len(self.samples) or last >= n_total or first > last:
+                return None
+            samples = self.samples.latest(n_total - first)[:last - first + 1]
+            n_channels, _, data_type = self.header
+            return struct.pack(DATA_DEF_FORMAT, n_channels, len(samples), data_type,
+                               samples.nbytes) + samples.tobytes()
+
+    def put_events(self, payload):
+        events = []
+        offset = 0
+        while offset + EVENT_DEF_SIZE <= len(payload):
+            size = EVENT_DEF_SIZE + struct.unpack_from(EVENT_DEF_FORMAT, payload, offset)[-1]
+            if offset + size > len(payload):
+                return False
+            events.append(bytes(payload[offset:offset + size]))
+            offset += size
+        with self.condition:
+            if self.header is None:
+                return False
+            self.events.extend(events)
+            self.n_events += len(events)
+            self.condition.notify_all()
+        return True
+
+    def get_events(self, index=None):
+        with self.condition:
+            if self.header is None:
+                return None
+            first, last = (self.n_events - len(self.events), self.n_events - 1) if index is None else index
+            if first < self.n_events - len(self.events) or last >= self.n_events or first > last:
+                return None
+            oldest = self.n_events - len(self.events)
+            return b''.join(self.events[i - oldest] for i in range(first, last + 1))
+
+    def flush(self, command):
+        with self.condition:
+            if self.header is None:
+                return False
+            if command == FLUSH_HDR:
+                self.header = None
+                self.chunks = b''
+                self.samples = None
+            elif command == FLUSH_DAT:
+                self.samples = SampleBuffer(self.capacity, self.header[0])
+            self.events.clear()
+            self.n_events = 0
+        return True
+
+    def wait(self, n_samples, n_events, timeout):
+        """
+        blocks until the buffer holds more than n_samples samples or more than n_events events
+        :param timeout: maximum time to wait in ms
+        :return: the number of samples and events, or None if there is no header
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.header is None or self.samples.n_appended > n_samples
+                                    or self.n_events > n_events, timeout / 1000)
+            if self.header is None:
+                return None
+            return self.samples.n_appended, self.n_events
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    """
+    Answers the requests of one client connection until it is closed
+    """
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.add_connection(self.request)
+        self.message = bytearray(MESSAGE_SIZE)
+        self.payload = bytearray(0)
+
+    def finish(self):
+        self.server.remove_connection(self.request)
+
+    def handle(self):
+        state = self.server.state
+        while True:
+            try:
+                if not self._receive(memoryview(self.message)):
+                    return
+                version, command, size = struct.unpack(MESSAGE_FORMAT, self.message)
+                if version != VERSION:
+                    return
+                if size > len(self.payload):
+                    self.payload = bytearray(size)
+                payload = memoryview(self.payload)[:size]
+                if not self._receive(payload):
+                    return
+                self._respond(*self._answer(state, command, payload))
+            except OSError:
+                return
+
+    def _answer(self, state, command, payload):
+        """
+        :return: response command and payload. None as command if no response is expected
+        """
+        if command in (PUT_HDR, PUT_HDR_NORESPONSE):
+            ok = len(payload) >= HEADER_DEF_SIZE and state.put_header(payload)
+            return (PUT_OK if ok else PUT_ERR) if command == PUT_HDR else None, b''
+        if command in (PUT_DAT, PUT_DAT_NORESPONSE):
+            ok = len(payload) >= DATA_DEF_SIZE and state.put_data(payload)
+            return (PUT_OK if ok else PUT_ERR) if command == PUT_DAT else None, b''
+        if command in (PUT_EVT, PUT_EVT_NORESPONSE):
+            ok = state.put_events(payload)
+            return (PUT_OK if ok else PUT_ERR) if command == PUT_EVT else None, b''
+        if command == GET_HDR:
+            response = state.get_header()
+            return (GET_ERR, b'') if response is None else (GET_OK, response)
+        if command in (GET_DAT, GET_EVT):
+            index = struct.unpack_from('II', payload) if len(payload) >= 8 else None
+            response = state.get_data(index) if command == GET_DAT else state.get_events(index)
+            return (GET_ERR, b'') if response is None else (GET_OK, response)
+        if command in (FLUSH_HDR, FLUSH_DAT, FLUSH_EVT):
+            return (FLUSH_OK if state.flush(command) else FLUSH_ERR), b''
+        if command == WAIT_DAT and len(payload) >= 12:
+            result = state.wait(*struct.unpack_from('III', payload))
+            return (WAIT_ERR, b'') if result is None else (WAIT_OK, struct.pack('II', *result))
+        return PUT_ERR, b''
+
+    def _respond(self, command, payload):
+        if command is not None:
+            self.request.sendall(struct.pack(MESSAGE_FORMAT, VERSION, command, len(payload)) + payload)
+
+    def _receive(self, view):
+        """
+        receives exactly len(view) bytes into view
+        :return: False if the connection has been closed
+        """
+        n_received = 0
+        while n_received < len(view):
+            n = self.request.recv_into(view[n_received:])
+            if n == 0:
+                return False
+            n_received += n
+        return True
+
+
+class BufferServer(socketserver.ThreadingTCPServer):
+    """
+    FieldTrip buffer server that runs in a background thread, every connection is served by its own thread.
+    Usage:
+        with BufferServer(port=0) as server:
+            client.connect('localhost', server.port)
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='localhost', port=1972, capacity=100000, max_events=10000):
+        """
+        :param host: host name or address to listen on
+        :param port: port to listen on. 0 picks a free port, see self.port
+        :param capacity: maximum number of samples that are kept
+        :param max_events: maximum number of events that are kept
+        """
+        super().__init__((host, port), RequestHandler)
+        self.port = self.server_address[1]
+        self.state = BufferState(capacity, max_events)
+        self._connections = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """
+        starts serving in a background thread
+        :return: self
+        """
+        self._thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        stops serving and closes all client connections
+        :return:
+        """
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.close_connections()
+        self.server_close()
+
+    def close_connections(self):
+        """
+        closes all client connections, e.g. to test reconnecting. The data is kept
+        :return:
+        """
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def add_connection(self, connection):
+        with self._lock:
+            self._connections.add(connection)
+
+    def remove_connection(self, connection):
+        with self._lock:
+            self._connections.discard(connection)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1972
+    capacity = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    with BufferServer('', port, capacity) as server:
+        print(f'FieldTrip buffer listening on port {server.port}. Press Ctrl+C to stop.')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -1,10 +1,20 @@
+import time
+
 import numpy as np
-from PyQt5.QtCore import QThread, pyqtSignal
 from events import Events
+from numpy.lib.stride_tricks import sliding_window_view
 from scipy import signal
-from scipy.integrate import simpson
 
 import FieldTrip
+from connection import ConnectionManager
+from metrics import Metrics
+from buffers import SampleBuffer
+from recorder import SessionRecorder
+from smoothing import SmoothingMethod, create_smoother
+from spectral import SlidingDFT, SpectralMethod, band_weights
+
+ALPHA_BAND = (8, 13)
+BETA_BAND = (14, 27)
 
 class ConnectionStatus:
     NOT_CONNECTED = 0
@@ -12,22 +22,45 @@ class ConnectionStatus:
     CONNECTED = 2
 
 class PowerValues:
+    """
+    raw and averaged alpha/beta power. Holds either a single set of values or, once values get appended,
+    the history of the last `retention` values in preallocated arrays
+    """
     raw_alpha = np.array([])
     raw_beta = np.array([])
     av_alpha = np.array([])
     av_beta = np.array([])
 
-    def __init__(self, raw_alpha=np.array([]), raw_beta=np.array([]), av_alpha=np.array([]), av_beta=np.array([])):
+    def __init__(self, raw_alpha=np.array([]), raw_beta=np.array([]), av_alpha=np.array([]), av_beta=np.array([]),
+                 retention=20000):
         self.raw_alpha = raw_alpha
         self.raw_beta = raw_beta
         self.av_alpha = av_alpha
         self.av_beta = av_beta
-    
+        self.retention = retention
+        self.timestamp = time.perf_counter()  # time the values were calculated
+        self._history = None
+
+    def __len__(self):
+        return np.size(self.raw_alpha)
+
     def append(self, new_values):
-        self.raw_alpha = np.append(self.raw_alpha, new_values.raw_alpha)
-        self.raw_beta = np.append(self.raw_beta, new_values.raw_beta)
-        self.av_alpha = np.append(self.av_alpha, new_values.av_alpha)
-        self.av_beta = np.append(self.av_beta, new_values.av_beta)
+        """
+        appends the given values in amortized O(1). Only the last `retention` values are kept
+        :param new_values: PowerValues with a single set of values
+        :return:
+        """
+        if self._history is None:
+            self._history = SampleBuffer(self.retention, 4)
+            if len(self) > 0:
+                self._history.append(np.column_stack((self.raw_alpha, self.raw_beta, self.av_alpha, self.av_beta)))
+        self._history.append(np.array([[new_values.raw_alpha, new_values.raw_beta,
+                                         new_values.av_alpha, new_values.av_beta]], dtype=float))
+        values = self._history.latest(len(self._history))
+        self.raw_alpha = values[:, 0]
+        self.raw_beta = values[:, 1]
+        self.av_alpha = values[:, 2]
+        self.av_beta = values[:, 3]
 
     def __str__(self):
         return 'raw_alpha: {} raw_beta: {} av_alpha: {} av_beta: {}'.format(self.raw_alpha, self.raw_beta, self.av_alpha, self.av_beta)
@@ -41,20 +74,37 @@ class Processing:
     def __init__(self):
         # FieldTrip related variables
         self.__ftc = FieldTrip.Client()
+        self.connection = ConnectionManager(self.__ftc)
         self.connection_status = ConnectionStatus.NOT_CONNECTED
         self.sfreq = 0
         self.block_size = 512
         self.sample_n = 0
         self.n_channels = 0
+        self.labels = []
         self.active_channels = []
+        self._fetch_n = 0  # index of the first sample that has not been fetched from the buffer yet
+        self._n_available = 0  # number of samples in the buffer, as of the last exchange
 
         # general Processing variables
         self._glide = 1
         self._average = 20
+        # smoothing method and further parameters of every band, see smoothing.create_smoother
+        self.smoothing = {'alpha': (SmoothingMethod.MOVING_AVERAGE, {}), 'beta': (SmoothingMethod.MOVING_AVERAGE, {})}
+        self._smoothers = None
+        self.spectral_method = SpectralMethod.WELCH
+        self.wait_timeout = 100  # ms to block on the FieldTrip buffer before checking the stop flag again
+        self._sdft = None
+        self._band_weights = dict()
+        self._calibration_cache = dict()
+        self.channel_powers = np.zeros((2, 0))  # latest alpha and beta power of every channel
+        self.batch_size = 2 ** 22  # maximum number of values of the blocks that are processed at once
 
         # data arrays
-        self.raw_data = np.array([])
-        self.power_values = PowerValues()
+        self.power_history_length = 20000  # number of power values that are kept
+        self.raw_data = SampleBuffer(self.block_size, self.n_channels)
+        self.power_values = PowerValues(retention=self.power_history_length)
+        self.recorder = None
+        self.metrics = Metrics()  # stage timings and counters, see metrics.Metrics
 
         # raw data from the calibration gets saved here and can be used for recalibration
         self.cal_alpha = np.array([])
@@ -72,6 +122,8 @@ class Processing:
         self.header_changed = Events()
         self.connection_changed = Events()
         self.calibration_progress_changed = Events()
+        # gets raised with the path of the recording file if a recording had to be stopped, e.g. on a new header
+        self.recording_stopped = Events()
 
     def reset_fieldtrip_vars(self):
         self.sfreq = 0
@@ -79,10 +131,22 @@ class Processing:
         self.sample_n = 0
         self.n_channels = 0
         self.active_channels = []
+        self._fetch_n = 0
+        self._n_available = 0
+        self._smoothers = None
 
     def clear_vals(self):
-        self.power_values = PowerValues()
-        self.raw_data = np.array([])
+        self.power_values = PowerValues(retention=self.power_history_length)
+        self._smoothers = None
+        self.reset_raw_data()
+
+    def reset_raw_data(self):
+        """
+        replaces the raw data buffer with an empty one that holds one block. Recordings are written by
+        the SessionRecorder, so no older samples are needed
+        :return:
+        """
+        self.raw_data = SampleBuffer(int(self.block_size), self.n_channels)
 
     def connect(self, host_name, port, connect_run):
         """
@@ -91,39 +155,50 @@ class Processing:
         :param port: port number
         :return: True if connection was successful, False if not
         """
-        connected = False
-        while not connected:
-            if not connect_run.is_set():
-                print('aborting connection process.')
-                break
-            try:
-                print(f'Trying to connect to filedtrip on {host_name} port {port}')
-                self.__ftc.connect(host_name, port)  # might throw IOError
-                connected = True
-                self.set_connection_status(ConnectionStatus.WAIT_FOR_HEADER)
-                print("connected to FieldTrip. Waiting for header...")
-            except IOError:
-                print('connection to Fieldtrip failed. Trying again...')
-                pass
-
-        header = None
-        while header is None:
-            if not connect_run.is_set():
-                print('aborting connection process.')
-                break
-            header = self.get_header()
-            if header is not None:
-                if self.raw_data.size == 0:
-                    self.raw_data = self.raw_data.reshape((0, self.n_channels))
-                self.set_connection_status(ConnectionStatus.CONNECTED)
-                print('header received. Ready for processing.')
-                print(f'[header] channels: {header.nChannels} sfreq: {header.fSample}')
+        if not self.connection.connect(host_name, port, connect_run):
+            print('aborting connection process.')
+            return False
+        self.set_connection_status(ConnectionStatus.WAIT_FOR_HEADER)
+        print("connected to FieldTrip. Waiting for header...")
+
+        header = self.connection.retry_connected(self.get_header, connect_run)
+        if header is None:
+            print('aborting connection process.')
+            return False
+        self.set_connection_status(ConnectionStatus.CONNECTED)
+        print('header received. Ready for processing.')
+        print(f'[header] channels: {header.nChannels} sfreq: {header.fSample}')
+        return True
+
+    def reconnect(self, running):
+        """
+        re-establishes a lost connection to the last host. Processing resumes at the current sample_n,
+        unless the buffer has been restarted in the meantime
+        :param running: requestflag for aborting the reconnection
+        :return: True if the connection was re-established, False if not
+        """
+        self.set_connection_status(ConnectionStatus.NOT_CONNECTED)
+        if not self.connection.reconnect(running):
+            return False
+        self.set_connection_status(ConnectionStatus.WAIT_FOR_HEADER)
+        header = self.connection.retry_connected(self.get_header, running)
+        if header is None:
+            return False
+        if header.nSamples < self._fetch_n:
+            print('FieldTrip buffer has been restarted. Continuing with its latest samples.')
+            self.set_latest_sample()
+        self.metrics.set('reconnects', self.connection.n_reconnects)
+        self.set_connection_status(ConnectionStatus.CONNECTED)
+        print('reconnected to FieldTrip.')
+        return True
 
     def disconnect(self):
         """
         Disconnects the FieldTrip Client
         :return:
         """
+        self.connection.host_name = None  # no automatic reconnects to this host anymore
+        self.stop_recording()
         self.__ftc.disconnect()
         self.reset_fieldtrip_vars()
         self.set_connection_status(ConnectionStatus.NOT_CONNECTED)
@@ -133,11 +208,70 @@ class Processing:
         self.connection_status = status
         self.connection_changed.on_change(status)
 
+    def get_glide(self):
+        return self._glide
+
+    def get_average(self):
+        return self._average
+
     def set_glide(self, glide):
         self._glide = glide
+        self._smoothers = None
 
     def set_average(self, av):
+        """
+        :param av: number of values of the moving average and the median, see smoothing.create_smoother
+        """
         self._average = av
+        self._smoothers = None
+
+    def set_smoothing(self, band, method, **params):
+        """
+        selects how the power of a band is smoothed
+        :param band: 'alpha' or 'beta'
+        :param method: see smoothing.SmoothingMethod
+        :param params: further parameters of the smoother, e.g. min_cutoff and beta of the one euro filter.
+                       A window given here is used instead of the average
+        :return:
+        """
+        self.smoothing[band] = (method, params)
+        self._smoothers = None
+
+    def create_smoothers(self):
+        """
+        :return: dict with a new Smoother for every band, with the current settings
+        """
+        rate = self.sfreq / self.get_step_size() if self.sfreq > 0 else 1.0
+        return {band: create_smoother(method, **dict({'window': self._average, 'rate': rate}, **params))
+                for band, (method, params) in self.smoothing.items()}
+
+    def set_spectral_method(self, method):
+        """
+        selects how the band powers are estimated
+        :param method: SpectralMethod.WELCH computes a welch spectrum of the whole block on every step,
+                       SpectralMethod.SLIDING_DFT only updates the alpha/beta bins with the new samples.
+                       While connected, the sliding DFT is set up right away from the samples of the current block,
+                       so the change also applies to a running processing
+        :return:
+        """
+        self.spectral_method = method
+        sdft = None
+        if method == SpectralMethod.SLIDING_DFT and self.sfreq > 0:
+            sdft = self.create_sliding_dft()
+            sdft.push(np.array(self.raw_data.latest(self.block_size)))
+        self._sdft = sdft
+
+    def get_sliding_dft(self):
+        """
+        :return: the SlidingDFT that is fed with the fetched samples, or None if the spectrum is calculated per block
+        """
+        return self._sdft
+
+    def create_sliding_dft(self):
+        """
+        :return: a SlidingDFT tracking the alpha and beta band of all channels over one block
+        """
+        return SlidingDFT(self.sfreq, self.block_size, self.n_channels, [ALPHA_BAND, BETA_BAND])
 
     def set_active_channels(self, chans):
         """
@@ -173,6 +307,30 @@ class Processing:
         self.set_active_channels(chans)
 
 
+    def start_recording(self, path, compress=False):
+        """
+        starts writing all incoming samples to a recording file in the background, see recorder.SessionRecorder
+        :param path: path of the recording file
+        :param compress: if True, the samples get compressed
+        :return:
+        """
+        self.stop_recording()
+        labels = self.labels if len(self.labels) == self.n_channels else \
+            [f"chan{i+1}" for i in range(self.n_channels)]
+        recorder = SessionRecorder(path, self.sfreq, labels, compress)
+        recorder.start()
+        self.recorder = recorder
+
+    def stop_recording(self):
+        """
+        stops the recording started with start_recording and closes the file
+        :return:
+        """
+        recorder = self.recorder
+        self.recorder = None
+        if recorder is not None:
+            recorder.stop()
+
     def get_vals_per_sec(self):
         """
         :return: the amount of calculated A/B values per second,
@@ -181,6 +339,12 @@ class Processing:
         val_per_sec = int(self.sfreq / (self.block_size / self._glide))
         return val_per_sec
 
+    def get_step_size(self):
+        """
+        :return: the number of samples the window is moved by on every step
+        """
+        return int(self.block_size / self._glide)
+
     def get_header(self):
         header = self.__ftc.getHeader()
         if header is None:
@@ -189,6 +353,14 @@ class Processing:
             self.sfreq = header.fSample
             self.block_size = self.sfreq
             self.n_channels = header.nChannels
+            self.labels = header.labels
+            if self.recorder is not None:
+                # the recording file holds a single header, so the samples of the new one cannot be appended
+                path = self.recorder.path
+                self.stop_recording()
+                print(f'header changed. Recording saved to {path}')
+                self.recording_stopped.on_change(path)
+            self.reset_raw_data()
             self.header_changed.on_change(header)
         if len(self.active_channels) > header.nChannels:
             chans = np.where(self.active_channels < header.nChannels, self.active_channels)
@@ -197,32 +369,114 @@ class Processing:
 
     def get_data(self):
         """
-        retrieves the next block of data from the FieldTrip Client
-        :return: array of data with the length of set blocksize
+        retrieves the samples of the next block that have not been fetched from the FieldTrip Client yet.
+        The rest of the block is already stored in self.raw_data
+        :return: array with the new samples + True if the next block is complete, False if not
         """
         if not self.__ftc.isConnected:
             self.set_connection_status(ConnectionStatus.NOT_CONNECTED)
             return [], False
 
-        header = self.get_header()
-        if header is None:
+        stop = int(self.sample_n + self.block_size)
+        if self._n_available < stop:
+            # only ask for the header if the last exchange did not report enough samples
+            header = self.get_header()
+            if header is None:
+                return [], False
+            self._n_available = header.nSamples
+            if self._n_available < stop:
+                return [], False
+        start = int(max(self._fetch_n, self.sample_n))
+        try:
+            d = self.__ftc.getData([start, stop - 1])
+        except IOError:
+            # the response might be incomplete, so the connection can't be used anymore
+            self.__ftc.disconnect()
             return [], False
-        if header.nSamples >= self.sample_n + self.block_size:
-            stop = self.sample_n + self.block_size - 1
-            d = self.__ftc.getData([self.sample_n, stop])
-            return d, True
-        else:
+        if d is None:
+            # the samples are not in the buffer anymore
+            sample_n = self.sample_n
+            self.set_latest_sample()
+            self.metrics.increment('dropped_steps', max(int((self.sample_n - sample_n) / self.get_step_size()), 0))
+            return [], False
+        if d.shape[1] != self.n_channels:
+            self.get_header()
             return [], False
+        return d, True
+
+    def wait_for_data(self, running, timeout=None):
+        """
+        blocks on the FieldTrip buffer (WAIT_DAT) until the samples for the next block are available.
+        If the connection has been lost, it gets re-established first
+        :param running: requestflag for aborting a reconnection
+        :param timeout: maximum time to wait in ms. Defaults to self.wait_timeout
+        :return: True if the next block is available, False if the timeout expired or the request failed
+        """
+        if timeout is None:
+            timeout = self.wait_timeout
+        if not self.__ftc.isConnected:
+            self.reconnect(running)
+            return False
+        needed = int(self.sample_n + self.block_size)
+        try:
+            # the buffer returns as soon as it holds more samples than the threshold. events are ignored
+            n_samples, n_events = self.__ftc.wait(needed - 1, 0xFFFFFFFF, timeout)
+        except IOError:
+            # the response might be incomplete, so the connection can't be used anymore
+            self.__ftc.disconnect()
+            return False
+        self._n_available = n_samples
+        return n_samples >= needed
 
     def get_psd(self, x):
         """
         calculates the frequency spectrum of the given block x with the sampling rate sf
-        :param x: array of values
+        :param x: array of values. If x is two-dimensional, the spectrum of every column is calculated at once
         :return: freqs the frequency indices and psd the power of each frequency
         """
-        freqs, psd = signal.welch(x, self.sfreq, nperseg=x.size)
+        freqs, psd = signal.welch(x, self.sfreq, nperseg=x.shape[0], axis=0)
         return freqs, psd
 
+    def get_band_weights(self, n, bands):
+        """
+        :param n: number of samples of the block
+        :param bands: list of (lo, up) tuples
+        :return: matrix with one row of simpson weights per band, to be multiplied with the psd of a block of n samples
+        """
+        key = (self.sfreq, n, tuple(bands))
+        if key not in self._band_weights:
+            self._band_weights[key] = np.array([band_weights(self.sfreq, n, lo, up) for lo, up in bands])
+        return self._band_weights[key]
+
+    def get_channel_band_powers(self, x, bands):
+        """
+        calculates the bandpowers of every channel of the given data for several bands with a single spectrum
+        :param x: array of shape (samples, channels)
+        :param bands: list of (lo, up) tuples with the limits of each band
+        :return: array of shape (bands, channels)
+        """
+        freqs, psd = self.get_psd(x)
+        return self.get_band_weights(x.shape[0], bands) @ psd
+
+    def get_active_mean(self, channel_powers, axis=-1):
+        """
+        :param channel_powers: array with per-channel powers
+        :param axis: the channel axis of channel_powers
+        :return: the mean over the active channels
+        """
+        return np.mean(np.take(channel_powers, self.active_channels, axis=axis), axis=axis)
+
+    def get_band_powers(self, x, bands):
+        """
+        calculates the bandpowers of the given data for several bands with a single spectrum of all active channels
+        :param x: array of shape (samples, channels)
+        :param bands: list of (lo, up) tuples with the limits of each band
+        :return: array with the mean power over all active channels for each band
+        """
+        if len(self.active_channels) == 0:
+            return np.array([])
+        return np.mean(self.get_channel_band_powers(x[:, self.active_channels], bands), axis=1)
+
     def get_band_power(self, x, lo, up):
         """
         calculates the bandpower of the given data within the given band
@@ -233,15 +487,7 @@ class Processing:
         """
         if len(self.active_channels) == 0:
             return np.array([])
-        powers = np.array([])
-        for i in self.active_channels:
-            freq_res = x[:, i].size / self.sfreq
-            freqs, psd = self.get_psd(x[:, i])
-            band = np.logical_and(freqs >= lo, freqs <= up)
-            power = simpson(y=psd[band], dx=freq_res, axis=0)
-            powers = np.append(powers, power)
-        mean_power = np.mean(powers)
-        return mean_power
+        return self.get_band_powers(x, [(lo, up)])[0]
 
     def set_latest_sample(self):
         """
@@ -249,38 +495,62 @@ class Processing:
         :return:
         """
         self.sample_n = self.__ftc.getHeader().nSamples
+        self._n_available = self.sample_n
+        self._fetch_n = self.sample_n
+        if self.spectral_method == SpectralMethod.SLIDING_DFT:
+            self._sdft = self.create_sliding_dft()
 
     def get_next_block(self):
         """
-        retrieves the next block from the buffer, if available. stores it in the self.raw_data array
-        :return: the block of data + True if new data was available, False if not
+        retrieves the next block from the buffer, if available. Only the samples that have not been fetched before
+        are transferred, the block is then taken from the self.raw_data buffer
+        :return: a view on the block of data + True if new data was available, False if not
         """
-        d, has_new = self.get_data()
-        if has_new:
-            step = int(self.block_size / self._glide)
-            self.sample_n += step
-            new_samples = d[-step:, :]
-            self.raw_data = np.concatenate((self.raw_data, new_samples), axis=0)
+        start = time.perf_counter()
+        new_samples, has_new = self.get_data()
+        self.metrics.observe('fetch', time.perf_counter() - start)
+        if not has_new:
+            return [], False
+        self.raw_data.append(new_samples)
+        if self.recorder is not None:
+            self.recorder.append(new_samples, int(max(self._fetch_n, self.sample_n)))
+        if self._sdft is not None:
+            self._sdft.push(new_samples)
+        self._fetch_n = int(self.sample_n + self.block_size)
+        # samples that were already in the buffer when the block was complete
+        self.metrics.set('lag_samples', max(self._n_available - self._fetch_n, 0))
+        self.sample_n += self.get_step_size()
+        d = self.raw_data.latest(self.block_size)
         return d, has_new
 
-    def process_block(self, d, raw_alphas, raw_betas) -> PowerValues:
+    def process_block(self, d, sdft=None) -> PowerValues:
         """
-        processes the given block d. calculates its alpha and beta power raw as well as averaged
-        and stores it in the given arrays
-        :param raw_betas: an array with the last raw beta powers to calculate the average power from
-        :param raw_alphas: an array with the last raw alpha powers to calculate the average power from
+        processes the given block d. calculates its alpha and beta power raw as well as smoothed.
+        The smoothers keep their state from block to block
         :param d: (data) the block
+        :param sdft: optional SlidingDFT that has been fed up to the end of d. If given, the band powers are
+                     read from it instead of calculating the spectrum of d
         :return: the averaged alpha and beta value
         """
-        if len(self.active_channels) != 0 and len(d[:, 0]) >= self.block_size:
-            raw_alpha_power = self.get_band_power(d, 8, 13)
-            raw_beta_power = self.get_band_power(d, 14, 27)
-
-            raw_alphas = np.append(raw_alphas, raw_alpha_power)
-            raw_betas = np.append(raw_betas, raw_beta_power) 
-
-            av_alpha_power = np.mean(raw_alphas[-self._average:])
-            av_beta_power = np.mean(raw_betas[-self._average:])
+        if len(d[:, 0]) < self.block_size:
+            return None
+        # the powers of all channels are kept, so changing the active channels needs no spectral work
+        start = time.perf_counter()
+        if sdft is not None:
+            self.channel_powers = sdft.band_powers()
+        else:
+            self.channel_powers = self.get_channel_band_powers(d, [ALPHA_BAND, BETA_BAND])
+        self.metrics.observe('spectral', time.perf_counter() - start)
+        if len(self.active_channels) != 0:
+            start = time.perf_counter()
+            raw_alpha_power, raw_beta_power = self.get_active_mean(self.channel_powers)
+
+            smoothers = self._smoothers
+            if smoothers is None:
+                smoothers = self._smoothers = self.create_smoothers()
+            av_alpha_power = smoothers['alpha'].update(raw_alpha_power)
+            av_beta_power = smoothers['beta'].update(raw_beta_power)
+            self.metrics.observe('smoothing', time.perf_counter() - start)
             return PowerValues(raw_alpha_power, raw_beta_power, av_alpha_power, av_beta_power)
         else:
             return None
@@ -295,39 +565,142 @@ class Processing:
         self.set_latest_sample()
         print("processing started")
         while running.is_set():
+            if not self.wait_for_data(running):
+                continue
             d, has_new = self.get_next_block()
             if has_new:
-                new_values = self.process_block(d, self.power_values.raw_alpha, self.power_values.raw_beta)
+                new_values = self.process_block(d, self._sdft)
                 if new_values is not None:
                     self.power_values.append(new_values)
-                    print(f'calculated new power values: {new_values}')
+                    self.metrics.increment('steps')
                     self.new_values_event.on_change(new_values)
 
         print("processing finished")
 
+    def get_window_starts(self, n_samples):
+        """
+        :param n_samples: number of recorded samples
+        :return: the start index of every complete block that gets processed from a recording, with the current glide
+        """
+        return self.get_window_starts_between(0, n_samples)
+
+    def get_window_starts_between(self, first, n_samples):
+        """
+        :param first: smallest start index
+        :param n_samples: number of recorded samples
+        :return: the start indices from first on of every complete block, see get_window_starts
+        """
+        # the blocks are moved by the same whole number of samples as in get_next_block
+        step = self.get_step_size()
+        k = np.arange(-(-int(first) // step), (int(n_samples) - int(self.block_size)) // step + 1)
+        return k * step
+
+    def get_window_powers(self, data, starts=None):
+        """
+        calculates the alpha and beta power of every channel for every block of a recording at once.
+        The blocks are taken from a strided view on data and processed in batches of at most self.batch_size values
+        :param data: array of shape (samples, channels)
+        :param starts: start indices of the blocks. Default: all blocks, see get_window_starts
+        :return: array of shape (blocks, channels, 2) with the alpha and beta power
+        """
+        n = int(self.block_size)
+        if starts is None:
+            starts = self.get_window_starts(len(data))
+        powers = np.empty((len(starts), data.shape[1], 2))
+        if len(starts) == 0:
+            return powers
+        weights = self.get_band_weights(n, [ALPHA_BAND, BETA_BAND])
+        windows = sliding_window_view(data, n, axis=0)  # (samples - n + 1, channels, n)
+        batch = max(1, self.batch_size // (n * data.shape[1]))
+        for i in range(0, len(starts), batch):
+            freqs, psd = signal.welch(windows[starts[i:i + batch]], self.sfreq, nperseg=n, axis=-1)
+            powers[i:i + batch] = psd @ weights.T
+        return powers
+
+    def get_calibration_powers(self, data):
+        """
+        returns the powers of every block of the calibration data, see get_window_powers.
+        The per-channel powers are cached for the given data and glide, so selecting other channels
+        only needs the mean over the cached values
+        :param data: array of shape (samples, channels)
+        :return: array of shape (blocks, 2) with the alpha and beta power, averaged over the active channels
+        """
+        key = (id(data), self.sfreq, self.block_size, self._glide)
+        cached = self._calibration_cache.get(key)
+        if cached is None or cached[0] is not data:
+            cached = (data, self.get_window_powers(data))
+            self._calibration_cache[key] = cached
+        return self.get_active_mean(cached[1], axis=1)
+
+    def iter_recording(self, data):
+        """
+        processes a recording in batches of blocks, with the same results as the live processing with
+        the current settings. Only the values of one batch are held in memory at a time
+        :param data: array of shape (samples, channels)
+        :return: generator of (sample index at the end of each block, PowerValues of each block) per batch
+        """
+        return self.iter_recording_chunks([data])
+
+    def iter_recording_chunks(self, chunks):
+        """
+        like iter_recording, but takes the recording chunk by chunk, e.g. from RecordingReader.iter_chunks.
+        Only the samples of the blocks that are not complete yet are kept between the chunks
+        :param chunks: iterable of arrays of shape (samples, channels)
+        :return: generator of (sample index at the end of each block, PowerValues of each block) per batch
+        """
+        if len(self.active_channels) == 0:
+            return
+        n = int(self.block_size)
+        smoothers = self.create_smoothers()
+        pending = None  # samples from index offset on, that are part of blocks which have not been processed
+        offset = 0
+        next_start = 0
+        for chunk in chunks:
+            pending = chunk if pending is None else np.concatenate((pending, chunk))
+            starts = self.get_window_starts_between(next_start, offset + len(pending))
+            batch = max(1, self.batch_size // (n * pending.shape[1]))
+            for i in range(0, len(starts), batch):
+                powers = self.get_active_mean(self.get_window_powers(pending, starts[i:i + batch] - offset), axis=1)
+                values = PowerValues(powers[:, 0], powers[:, 1], smoothers['alpha'].filter(powers[:, 0]),
+                                     smoothers['beta'].filter(powers[:, 1]))
+                yield starts[i:i + batch] + n, values
+            if len(starts) > 0:
+                next_start = int(starts[-1]) + 1
+            # all further blocks start at next_start or later
+            drop = min(next_start - offset, len(pending))
+            pending = pending[drop:]
+            offset += drop
+
+    def process_recording(self, data):
+        """
+        processes a whole recording at once, with the same results as the live processing with the current settings
+        :param data: array of shape (samples, channels)
+        :return: PowerValues with the raw and averaged alpha/beta power of every block
+        """
+        batches = [values for samples, values in self.iter_recording(data)]
+        if not batches:
+            return PowerValues()
+        return PowerValues(*[np.concatenate([getattr(values, name) for values in batches])
+                             for name in ('raw_alpha', 'raw_beta', 'av_alpha', 'av_beta')])
+
     def recalibrate(self):
         """
         uses the recorded calibration data to calculate the min and max values of alpha/beta power
-        with the current glide and average settings
+        with the current glide and smoothing settings
         :return:
         """
+        cals = [self.cal_alpha, self.cal_beta]
+        # drop cached powers of previous calibrations
+        self._calibration_cache = {key: cached for key, cached in self._calibration_cache.items()
+                                   if any(cached[0] is cal for cal in cals)}
         av_alphas = []
         av_betas = []
-        cals = [self.cal_alpha, self.cal_beta]
         for cal in cals:
-            raw_alphas = []
-            raw_betas = []
-            if len(cal) > 0:
-                for i in range(1, int(len(cal) * self._glide / self.block_size)):
-                    start = int((self.block_size * (i - 1)) / self._glide)
-                    stop = int(start + self.block_size)
-                    block = cal[start:stop, :]
-                    power_values = self.process_block(block, raw_alphas, raw_betas)
-                    if power_values is not None:
-                        raw_alphas.append(power_values.raw_alpha)
-                        raw_betas.append(power_values.raw_beta)
-                        av_alphas.append(power_values.av_alpha)
-                        av_betas.append(power_values.av_beta)
+            if len(cal) > 0 and len(self.active_channels) > 0:
+                powers = self.get_calibration_powers(cal)
+                smoothers = self.create_smoothers()
+                av_alphas.extend(smoothers['alpha'].filter(powers[:, 0]))
+                av_betas.extend(smoothers['beta'].filter(powers[:, 1]))
         if av_alphas:
             self.alpha_max = max(av_alphas)
             self.alpha_min = min(av_alphas)
@@ -335,84 +708,50 @@ class Processing:
             self.beta_max = max(av_betas)
             self.beta_min = min(av_betas)
 
-    def calibrate_from_recording(self, data):
-        self.cal_alpha = data
-        self.cal_beta = data
-        self.recalibrate()       
-
-class ConnectionThread(QThread):
-    sig_connection_status = pyqtSignal(int) # ConnectionStatus
-
-    def __init__(self, processing, hostname, port_nr, connect_run, parent=None):
-        super(ConnectionThread, self).__init__(parent)
-        self.processing = processing
-        self.hostname = hostname
-        self.port_nr = port_nr
-        self.connect_run = connect_run
-
-    def run(self):
-        self.processing.connection_changed.on_change += self.on_connection_changed
-        self.processing.connect(self.hostname, self.port_nr, self.connect_run)
-
-    def on_connection_changed(self, status):
-        self.sig_connection_status.emit(status)
-
-
-class ProcessingThread(QThread):
-    sig_calculated_values = pyqtSignal(PowerValues)
-
-    def __init__(self, processing, proc_run, parent=None):
-        super(ProcessingThread, self).__init__(parent)
-        self.processing = processing
-        self.proc_run = proc_run
-
-    def run(self):
-        self.processing.new_values_event.on_change += self.on_new_values
-        self.processing.start_processing(self.proc_run)
-    
-    def on_new_values(self, new_values):
-        self.sig_calculated_values.emit(new_values)
-
-
-class CalibrationThread(QThread):
-    sig_calibration_progress = pyqtSignal(int)
-
-    def __init__(self, processing, alpha, beta, parent=None):
-        super(CalibrationThread, self).__init__(parent)
-        self.processing = processing
-        self.alpha = alpha
-        self.beta = beta
-        self.start()
-
-    def run(self):
-        self.calibrate(self.alpha, self.beta)
-
-    def calibrate(self, cal_a, cal_b):
+    def calibrate(self, cal_a, cal_b, running, progress=None, duration=60):
         """
         records one minute of raw data, that gets used to calibrate the min and max values of the alpha/beta power
         :param cal_a: if True, the recorded data gets used to calibrate alpha power
         :param cal_b: if True, the recorded data gets used to calibrate beta power
-        :return:
+        :param running: requestflag for aborting the calibration. The previous calibration values are kept then
+        :param progress: optional function that gets called with the progress in percent
+        :param duration: duration of the calibration in sec
+        :return: True if the calibration was completed, False if it was aborted
         """
         if not cal_a and not cal_b:
             raise ValueError('at least one of both parameters must be True')
-        proc = self.processing
-        proc.set_latest_sample()
-        val_sec = proc.get_vals_per_sec()
-        duration = 60  # duration of the calibration in sec
+        self.set_latest_sample()
+        val_sec = self.get_vals_per_sec()
         minute = val_sec * duration
+        self.raw_data.start_capture(int(duration * self.sfreq + self.block_size))
+        # the calibration data is not part of the recording
+        recorder = self.recorder
+        self.recorder = None
         i = 1
-        while i <= minute:
-            d, has_new = proc.get_next_block()
+        while i <= minute and running.is_set():
+            if not self.wait_for_data(running):
+                continue
+            d, has_new = self.get_next_block()
             if has_new:
-                progress = int(100 / minute * i)
-                self.sig_calibration_progress.emit(progress)
+                if progress is not None:
+                    progress(int(100 / minute * i))
                 i += 1
 
-        cal_data = proc.raw_data[-int(minute * proc.block_size):, :]
-        proc.raw_data = proc.raw_data[:-int(minute * proc.block_size), :]
+        cal_data = self.raw_data.stop_capture()
+        self.recorder = recorder
+        # the processing continues with the latest block, see set_latest_sample
+        self.reset_raw_data()
+        if not running.is_set():
+            print('calibration aborted.')
+            return False
         if cal_a:
-            proc.cal_alpha = cal_data
+            self.cal_alpha = cal_data
         if cal_b:
-            proc.cal_beta = cal_data
-        proc.recalibrate()
+            self.cal_beta = cal_data
+        self.recalibrate()
+        return True
+
+    def calibrate_from_recording(self, data):
+        self.cal_alpha = data
+        self.cal_beta = data
+        self.recalibrate()
@@ -0,0 +1,101 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import midi
+from playback import EEGPlayback
+from Processing import Processing
+
+"""
+Processes recordings offline, as fast as possible, instead of replaying them through the FieldTrip buffer.
+Usage: python batch.py rec1.csv rec2.csv --glide 4 --average 20 --workers 4
+Author: Edward Berndt
+"""
+
+
+def load_recording(path):
+    """
+    :param path: path of a recording (.mbr or csv with "# sfreq" as first line)
+    :return: the sampling rate and the data as array of shape (samples, channels)
+    """
+    recording = EEGPlayback(path)
+    recording.load_data()
+    return recording.sample_rate, recording.getAllData()
+
+
+def create_processing(sfreq, n_channels, channels, glide, average):
+    """
+    :return: a Processing instance set up for offline processing with the given settings
+    """
+    proc = Processing()
+    proc.sfreq = sfreq
+    proc.block_size = sfreq
+    proc.n_channels = n_channels
+    proc.set_glide(glide)
+    proc.set_average(average)
+    proc.active_channels = np.arange(n_channels) if channels is None else np.array(channels, dtype=int)
+    return proc
+
+
+def process_file(path, out_dir=None, channels=None, glide=1, average=20, calibration_file=None):
+    """
+    calculates the power values and MIDI CC values of every processing step of a recording
+    and writes them as csv next to the recording or into out_dir
+    :param path: path of the recording
+    :param out_dir: directory for the results
+    :param channels: numbers of the channels to use. Default: all channels
+    :param glide: number of steps per block
+    :param average: length of the moving average
+    :param calibration_file: recording to calibrate with. Default: the recording itself
+    :return: path of the written csv file
+    """
+    sfreq, data = load_recording(path)
+    proc = create_processing(sfreq, data.shape[1], channels, glide, average)
+    if calibration_file is not None:
+        proc.cal_alpha = load_recording(calibration_file)[1]
+    else:
+        proc.cal_alpha = data
+    proc.cal_beta = proc.cal_alpha
+    proc.recalibrate()
+
+    values = proc.process_recording(data)
+    samples = proc.get_window_starts(len(data)) + int(proc.block_size)
+    cc_alpha = [midi.to_midi(x, proc.alpha_min, proc.alpha_max) for x in values.av_alpha]
+    cc_beta = [midi.to_midi(x, proc.beta_min, proc.beta_max) for x in values.av_beta]
+
+    name = os.path.splitext(os.path.basename(path))[0] + '_powers.csv'
+    out_path = os.path.join(out_dir if out_dir else os.path.dirname(os.path.abspath(path)), name)
+    table = np.column_stack((samples, values.raw_alpha, values.raw_beta, values.av_alpha, values.av_beta,
+                             cc_alpha, cc_beta))
+    np.savetxt(out_path, table, delimiter=',', fmt=['%d', '%.9g', '%.9g', '%.9g', '%.9g', '%d', '%d'],
+               header='sample,raw_alpha,raw_beta,av_alpha,av_beta,cc_alpha,cc_beta')
+    return out_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Processes EEG recordings offline.')
+    parser.add_argument('files', nargs='+', help='recordings (.mbr or csv with "# sfreq" as first line)')
+    parser.add_argument('--out-dir', help='directory for the results. Default: next to each recording')
+    parser.add_argument('--channels', type=int, nargs='*', help='numbers of the channels to use. Default: all')
+    parser.add_argument('--glide', type=int, default=1, help='number of steps per block')
+    parser.add_argument('--average', type=int, default=20, help='length of the moving average')
+    parser.add_argument('--calibration-file', help='recording to calibrate with. Default: each recording itself')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes. Default: number of CPUs')
+    args = parser.parse_args(argv)
+
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(process_file, path, args.out_dir, args.channels, args.glide, args.average,
+                               args.calibration_file) for path in args.files]
+        for path, future in zip(args.files, futures):
+            try:
+                print(f'{path} -> {future.result()}')
+            except Exception as e:
+                print(f'{path} failed: {e}')
+
+
+if __name__ == '__main__':
+    main()
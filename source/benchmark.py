@@ -0,0 +1,259 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import threading
+import time
+
+import numpy as np
+
+import FieldTrip
+from FieldTripServer import BufferServer
+from Processing import Processing, ALPHA_BAND
+from spectral import SpectralMethod
+
+"""
+Measures latency and throughput of the processing at configurable loads, using the Python FieldTrip buffer server.
+For every combination of channels, sampling rate and glide, two runs are made:
+- throughput: the buffer is filled in advance, then the steps are processed as fast as possible
+- latency: samples are put into the buffer in real time until at least --min-steps steps have been processed,
+  every step is timed per stage and from the moment the last sample of its block was put into the buffer
+  until its values have been sent
+CPU time is measured on the processing thread only, so the buffer server threads are not included.
+Usage: python benchmark.py --channels 8 32 128 --sfreq 256 1024 4096 --glide 1 4 16 --output results.json
+Author: Edward Berndt
+"""
+
+PERCENTILES = (50, 90, 99)
+# maximum number of samples times channels that are generated for a throughput run
+MAX_VALUES = 2 ** 25
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the MIDIBrain processing.')
+    parser.add_argument('--channels', type=int, nargs='+', default=[8, 32, 128, 256], help='numbers of channels')
+    parser.add_argument('--sfreq', type=float, nargs='+', default=[256, 512, 1024, 2048, 4096],
+                        help='sampling rates')
+    parser.add_argument('--glide', type=int, nargs='+', default=[1, 4, 16], help='numbers of steps per block')
+    parser.add_argument('--spectral', choices=['welch', 'sdft'], nargs='+', default=['welch'],
+                        help='spectral estimation methods')
+    parser.add_argument('--duration', type=float, default=5.0, help='minimum duration of every latency run in sec')
+    parser.add_argument('--min-steps', type=int, default=200,
+                        help='minimum number of steps of every latency run, the run is extended to reach it')
+    parser.add_argument('--steps', type=int, default=100,
+                        help='number of steps of every throughput run, limited by MAX_VALUES')
+    parser.add_argument('--chunk-size', type=int, default=16, help='number of samples put into the buffer at once')
+    parser.add_argument('--midi-port', type=int,
+                        help='number of a MIDI output port. If given, the values are sent as CC messages')
+    parser.add_argument('--output', help='path of the json result file. Default: benchmark-<time>.json')
+    return parser.parse_args(argv)
+
+
+def create_signal(n_samples, n_channels, sfreq, seed=0, first_sample=0, rng=None):
+    """
+    :param first_sample: index of the first sample within the signal
+    :param rng: numpy Generator to continue with. Default: a new one from seed
+    :return: noise with an alpha oscillation as float32 array of shape (samples, channels)
+    """
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    t = np.arange(first_sample, first_sample + n_samples) / sfreq
+    alpha = np.sin(2 * np.pi * np.mean(ALPHA_BAND) * t)[:, np.newaxis]
+    return (rng.standard_normal((n_samples, n_channels)) + alpha).astype(np.float32)
+
+
+def iter_signal(n_chunks, chunk_size, n_channels, sfreq, seed=0):
+    """
+    yields the signal of create_signal in chunks, generated on demand so long runs need no memory
+    """
+    rng = np.random.default_rng(seed)
+    for i in range(n_chunks):
+        yield create_signal(chunk_size, n_channels, sfreq, first_sample=i * chunk_size, rng=rng)
+
+
+def summarize(values):
+    """
+    :param values: list of durations in sec
+    :return: dict with mean, percentiles and maximum in ms
+    """
+    if len(values) == 0:
+        return None
+    values = np.array(values) * 1000
+    summary = {'n': len(values), 'mean': float(np.mean(values)), 'max': float(np.max(values))}
+    for p in PERCENTILES:
+        summary[f'p{p}'] = float(np.percentile(values, p))
+    return summary
+
+
+def create_output(midi_port):
+    """
+    :return: function that sends the alpha and beta values of a step, or None if no MIDI port is used
+    """
+    if midi_port is None:
+        return None
+    import midi
+    midi.open_midi_port(midi_port)
+
+    def send(proc, new_values):
+        midi.send_control_change(midi.to_midi(new_values.av_alpha, proc.alpha_min, proc.alpha_max), 1)
+        midi.send_control_change(midi.to_midi(new_values.av_beta, proc.beta_min, proc.beta_max), 2)
+    return send
+
+
+def connect_processing(port, glide, spectral, running):
+    proc = Processing()
+    proc.set_glide(glide)
+    proc.set_average(20)
+    proc.set_spectral_method(spectral)
+    proc.connect('localhost', port, running)
+    proc.set_active_channels(np.arange(proc.n_channels))
+    proc.set_latest_sample()
+    return proc
+
+
+def run_throughput(data, sfreq, glide, spectral):
+    """
+    fills the buffer with data, then processes it as fast as possible
+    :return: dict with the number of steps, the step rate and the CPU time per step
+    """
+    running = threading.Event()
+    running.set()
+    with BufferServer(port=0, capacity=len(data)) as server:
+        client = FieldTrip.Client()
+        client.connect('localhost', server.port)
+        client.putHeader(data.shape[1], sfreq, FieldTrip.DATATYPE_FLOAT32)
+        proc = connect_processing(server.port, glide, spectral, running)
+        for start in range(0, len(data), 65536):
+            client.putData(data[start:start + 65536])
+
+        n_steps = 0
+        wall, cpu = time.perf_counter(), time.thread_time()
+        while proc.wait_for_data(running, timeout=0):
+            d, has_new = proc.get_next_block()
+            if has_new and proc.process_block(d, proc.get_sliding_dft()) is not None:
+                n_steps += 1
+        wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+        proc.disconnect()
+        client.disconnect()
+    return {'steps': n_steps,
+            'step_rate': n_steps / wall if wall > 0 else None,
+            'cpu_per_step_ms': 1000 * cpu / n_steps if n_steps > 0 else None}
+
+
+def feed(client, chunks, chunk_size, sfreq, put_times, running):
+    """
+    puts the chunks into the buffer at the sampling rate and stores the time every chunk was put in put_times
+    """
+    start = time.perf_counter()
+    for i, chunk in enumerate(chunks):
+        delay = start + (i + 1) * chunk_size / sfreq - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        if not running.is_set():
+            return
+        # stored before sending, the processing might receive the chunk before putData returns
+        put_times[i] = time.perf_counter()
+        client.putData(chunk)
+
+
+def run_latency(n_channels, sfreq, glide, spectral, chunk_size, duration, min_steps, send):
+    """
+    puts a signal into the buffer in real time and processes it like Processing.start_processing,
+    timing every stage of every step. End to end is measured from putting the last sample of a block
+    until its values have been sent. The run lasts at least duration sec and min_steps steps
+    :return: dict with latency statistics per stage and end to end
+    """
+    running = threading.Event()
+    running.set()
+    stages = {'fetch': [], 'processing': [], 'output': [], 'end_to_end': []}
+    # Processing uses blocks of one second
+    n_samples = max(int(duration * sfreq), int(sfreq) + (min_steps + 1) * int(sfreq / glide))
+    n_chunks = -(-n_samples // chunk_size)
+    put_times = np.full(n_chunks, np.nan)
+    with BufferServer(port=0, capacity=max(int(10 * sfreq), 4 * chunk_size)) as server:
+        client = FieldTrip.Client()
+        client.connect('localhost', server.port)
+        client.putHeader(n_channels, sfreq, FieldTrip.DATATYPE_FLOAT32)
+        proc = connect_processing(server.port, glide, spectral, running)
+        step = int(proc.block_size / glide)
+        chunks = iter_signal(n_chunks, chunk_size, n_channels, sfreq)
+        feeder = threading.Thread(target=feed, args=(client, chunks, chunk_size, sfreq, put_times, running))
+        feeder.start()
+
+        while feeder.is_alive() or proc.sample_n + proc.block_size <= n_chunks * chunk_size:
+            if not proc.wait_for_data(running):
+                if feeder.is_alive():
+                    continue
+                break
+            t0 = time.perf_counter()
+            d, has_new = proc.get_next_block()
+            t1 = time.perf_counter()
+            if not has_new:
+                continue
+            new_values = proc.process_block(d, proc.get_sliding_dft())
+            t2 = time.perf_counter()
+            if new_values is None:
+                continue
+            proc.power_values.append(new_values)
+            if send is not None:
+                send(proc, new_values)
+            t3 = time.perf_counter()
+            # the block ended with the sample before sample_n + block_size - step
+            last_sample = int(proc.sample_n - step + proc.block_size) - 1
+            stages['fetch'].append(t1 - t0)
+            stages['processing'].append(t2 - t1)
+            stages['output'].append(t3 - t2)
+            stages['end_to_end'].append(t3 - put_times[last_sample // chunk_size])
+        running.clear()
+        feeder.join()
+        proc.disconnect()
+        client.disconnect()
+    result = {stage: summarize(values) for stage, values in stages.items()}
+    result['steps'] = len(stages['end_to_end'])
+    return result
+
+
+def run_load(n_channels, sfreq, glide, spectral, args, send):
+    method = SpectralMethod.SLIDING_DFT if spectral == 'sdft' else SpectralMethod.WELCH
+    result = {'channels': n_channels, 'sfreq': sfreq, 'glide': glide, 'spectral': spectral,
+              'required_step_rate': float(glide)}
+    n_samples = int(sfreq + args.steps * int(sfreq / glide))
+    n_samples = min(n_samples, max(MAX_VALUES // n_channels, int(2 * sfreq)))
+    result['throughput'] = run_throughput(create_signal(n_samples, n_channels, sfreq), sfreq, glide, method)
+    result['latency'] = run_latency(n_channels, sfreq, glide, method, args.chunk_size, args.duration,
+                                    args.min_steps, send)
+    step_rate = result['throughput']['step_rate']
+    result['realtime_factor'] = step_rate / glide if step_rate else None
+    return result
+
+
+def print_result(result):
+    e2e = result['latency']['end_to_end'] or {}
+    print(f"{result['channels']:>4} ch {result['sfreq']:>6.0f} Hz glide {result['glide']:>2} {result['spectral']:<5} "
+          f"| {result['throughput']['step_rate'] or 0:>9.1f} steps/s "
+          f"{result['throughput']['cpu_per_step_ms'] or 0:>7.2f} ms CPU/step "
+          f"| latency p50 {e2e.get('p50', 0):>7.2f} ms p99 {e2e.get('p99', 0):>7.2f} ms "
+          f"over {result['latency']['steps']} steps")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    send = create_output(args.midi_port)
+    output = args.output or time.strftime('benchmark-%Y%m%d-%H%M%S.json')
+    report = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'platform': platform.platform(),
+              'python': platform.python_version(), 'numpy': np.__version__, 'cpu_count': os.cpu_count(),
+              'duration': args.duration, 'min_steps': args.min_steps, 'chunk_size': args.chunk_size, 'midi': args.midi_port is not None,
+              'results': []}
+    for n_channels, sfreq, glide, spectral in itertools.product(args.channels, args.sfreq, args.glide,
+                                                                args.spectral):
+        result = run_load(n_channels, sfreq, glide, spectral, args, send)
+        print_result(result)
+        report['results'].append(result)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import numpy as np
+
+"""
+Author: Edward Berndt
+"""
+
+
+class SampleBuffer:
+    """
+    Fixed-capacity circular buffer for multichannel samples.
+    Every sample is written twice (at i and i + capacity), so the latest n samples are always
+    available as one contiguous view without copying. Appending costs O(new samples),
+    independent of how long the session has been running.
+    Optionally, a capture region records all appended samples into a separate array, e.g. for calibration.
+    """
+
+    def __init__(self, capacity, n_channels):
+        """
+        :param capacity: maximum number of samples that are kept
+        :param n_channels: number of channels
+        """
+        self.capacity = int(capacity)
+        self.n_channels = int(n_channels)
+        self.n_appended = 0
+        self._size = 0
+        self._data = None
+        self._capture = None
+        self._n_captured = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, samples):
+        """
+        appends the given samples. If more samples than the capacity are appended, only the latest are kept
+        :param samples: array of shape (samples, channels)
+        :return:
+        """
+        m = len(samples)
+        if m == 0:
+            return
+        if self._data is None:
+            self._data = np.zeros((2 * self.capacity, self.n_channels), dtype=samples.dtype)
+        self._append_capture(samples)
+
+        kept = samples[-self.capacity:, :]
+        pos = (self.n_appended + m - len(kept)) % self.capacity
+        first = min(len(kept), self.capacity - pos)
+        self._data[pos:pos + first, :] = kept[:first]
+        self._data[pos + self.capacity:pos + self.capacity + first, :] = kept[:first]
+        rest = len(kept) - first
+        if rest > 0:
+            self._data[:rest, :] = kept[first:]
+            self._data[self.capacity:self.capacity + rest, :] = kept[first:]
+        self.n_appended += m
+        self._size = min(self._size + m, self.capacity)
+
+    def latest(self, n):
+        """
+        :param n: number of samples
+        :return: a view on the latest n samples (or less, if less are available), oldest sample first.
+                 The view is only valid until the next call of append
+        """
+        n = min(int(n), self._size)
+        if self._data is None:
+            return np.zeros((0, self.n_channels))
+        end = self.n_appended % self.capacity + self.capacity
+        return self._data[end - n:end, :]
+
+    def get(self):
+        """
+        :return: a copy of all samples in the buffer, oldest sample first
+        """
+        return self.latest(self._size).copy()
+
+    def start_capture(self, n):
+        """
+        starts recording every appended sample into a separate capture region
+        :param n: maximum number of samples to capture
+        :return:
+        """
+        self._capture = None if n <= 0 else np.zeros((int(n), self.n_channels), dtype=self._data_type())
+        self._n_captured = 0
+
+    def stop_capture(self):
+        """
+        stops the capture started with start_capture
+        :return: the captured samples
+        """
+        if self._capture is None:
+            return np.zeros((0, self.n_channels))
+        captured = self._capture[:self._n_captured]
+        self._capture = None
+        self._n_captured = 0
+        return captured
+
+    def _append_capture(self, samples):
+        if self._capture is None:
+            return
+        n = min(len(samples), len(self._capture) - self._n_captured)
+        self._capture[self._n_captured:self._n_captured + n, :] = samples[:n]
+        self._n_captured += n
+
+    def _data_type(self):
+        return np.float32 if self._data is None else self._data.dtype
@@ -0,0 +1,126 @@
+import socket
+import time
+
+import FieldTrip
+
+"""
+Author: Edward Berndt
+"""
+
+
+class ConnectionManager:
+    """
+    Keeps a FieldTrip.Client connected: retries with exponential backoff, tunes the socket
+    and re-establishes lost connections to the last used host.
+    """
+
+    def __init__(self, client=None, min_delay=0.1, max_delay=5.0, timeout=5.0):
+        """
+        :param client: the FieldTrip.Client to manage. A new one is created if None
+        :param min_delay: delay in sec before the first retry
+        :param max_delay: maximum delay in sec between two retries
+        :param timeout: socket timeout in sec. Must be longer than any WAIT_DAT timeout
+        """
+        self.client = client if client is not None else FieldTrip.Client()
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.host_name = None
+        self.port = None
+        self.n_reconnects = 0
+
+    def connect(self, host_name, port, running):
+        """
+        connects the client, retrying with exponential backoff until it succeeds or running is cleared
+        :param host_name: host_name of the host
+        :param port: port number
+        :param running: threading.Event, the attempts stop as soon as it is cleared
+        :return: True if the connection was established, False if aborted
+        """
+        self.host_name = host_name
+        self.port = port
+        return self.retry(self._try_connect, running) is not None
+
+    def reconnect(self, running):
+        """
+        closes the current connection and connects again to the last host
+        :param running: threading.Event, the attempts stop as soon as it is cleared
+        :return: True if the connection was re-established, False if aborted
+        """
+        if self.host_name is None:
+            return False
+        self.client.disconnect()
+        print(f'connection to FieldTrip lost. Reconnecting to {self.host_name} port {self.port}...')
+        if self.retry(self._try_connect, running) is None:
+            return False
+        self.n_reconnects += 1
+        return True
+
+    def retry_connected(self, attempt, running):
+        """
+        like retry, but connects the client again before an attempt whenever the connection has been lost,
+        e.g. because the buffer has been restarted while waiting for its header
+        :param attempt: function without arguments. Returns None or raises IOError if it failed
+        :param running: threading.Event, the attempts stop as soon as it is cleared
+        :return: the result of attempt, or None if aborted
+        """
+        def connected_attempt():
+            if not self.client.isConnected:
+                self._try_connect()
+            try:
+                return attempt()
+            except IOError:
+                # a failed request leaves the socket in an unknown state
+                self.client.disconnect()
+                raise
+        return self.retry(connected_attempt, running)
+
+    def retry(self, attempt, running):
+        """
+        calls attempt until it returns something else than None, waiting exponentially longer between the calls
+        :param attempt: function without arguments. Returns None or raises IOError if it failed
+        :param running: threading.Event, the attempts stop as soon as it is cleared
+        :return: the result of attempt, or None if aborted
+        """
+        delay = self.min_delay
+        while running.is_set():
+            try:
+                result = attempt()
+                if result is not None:
+                    return result
+            except IOError:
+                pass
+            self._sleep(delay, running)
+            delay = min(delay * 2, self.max_delay)
+        return None
+
+    def tune_socket(self, sock):
+        """
+        disables Nagle's algorithm, so small requests are sent immediately, enables TCP keepalive
+        to detect dead connections and sets the timeout for blocking operations
+        :param sock: the connected socket
+        :return:
+        """
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # keepalive timings are only configurable on some platforms
+        for option, value in (('TCP_KEEPIDLE', 1), ('TCP_KEEPINTVL', 1), ('TCP_KEEPCNT', 3)):
+            if hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+        sock.settimeout(self.timeout)
+
+    def _try_connect(self):
+        print(f'Trying to connect to fieldtrip on {self.host_name} port {self.port}')
+        self.client.disconnect()
+        self.client.connect(self.host_name, self.port)  # might throw IOError
+        self.tune_socket(self.client.sock)
+        return True
+
+    @staticmethod
+    def _sleep(duration, running):
+        end = time.monotonic() + duration
+        while running.is_set():
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.05))
@@ -0,0 +1,211 @@
+import bisect
+import http.server
+import os
+import threading
+
+import numpy as np
+
+"""
+Low-overhead timing histograms and counters for the processing pipeline, exportable as text
+Author: Edward Berndt
+"""
+
+# upper bounds of the histogram buckets in sec, 4 buckets per factor of 10 from 10 us to 10 s
+BUCKET_BOUNDS = [float(bound) for bound in np.geomspace(1e-5, 10, 25)]
+
+
+class Histogram:
+    """
+    Counts durations in fixed, logarithmically spaced buckets. Adding a value costs a binary search over
+    the bucket bounds, independent of how many values have been added. Percentiles are approximated
+    by the upper bound of the bucket they fall into.
+    """
+
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.n = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        """
+        :param value: duration in sec
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.n += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.sum / self.n if self.n > 0 else 0.0
+
+    def percentile(self, p):
+        """
+        :param p: percentile from 0 to 100
+        :return: upper bound of the bucket holding the percentile in sec, or the maximum if that is smaller
+        """
+        if self.n == 0:
+            return 0.0
+        rank = p / 100 * self.n
+        total = 0
+        for i, count in enumerate(self.counts):
+            total += count
+            if total >= rank and count > 0:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+
+class Metrics:
+    """
+    Collects a histogram per stage, counters and gauges. Stages and counters are created on first use,
+    so every part of the pipeline can report into the same Metrics without registering first.
+    """
+
+    def __init__(self):
+        self.histograms = dict()
+        self.counters = dict()
+        self.gauges = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, stage, duration):
+        """
+        adds a duration to the histogram of the given stage
+        :param stage: name of the stage
+        :param duration: duration in sec
+        """
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(stage, Histogram())
+        histogram.add(duration)
+
+    def increment(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def set(self, gauge, value):
+        self.gauges[gauge] = value
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    def format_status(self, stages=('spectral', 'delivery', 'midi')):
+        """
+        :param stages: stages to show
+        :return: a one-line summary for the status bar
+        """
+        parts = []
+        for stage in stages:
+            histogram = self.histograms.get(stage)
+            if histogram is not None and histogram.n > 0:
+                parts.append(f'{stage} {histogram.percentile(50) * 1000:.1f}/{histogram.percentile(99) * 1000:.1f} ms')
+        parts.append(f"lag {self.gauges.get('lag_samples', 0)} samples")
+        parts.append(f"dropped {self.counters.get('dropped_steps', 0)}")
+        parts.append(f"reconnects {self.gauges.get('reconnects', 0)}")
+        return ' | '.join(parts)
+
+    def to_text(self, prefix='midibrain'):
+        """
+        :return: all metrics in the Prometheus text format. Durations are given in sec
+        """
+        lines = []
+        with self._lock:
+            histograms = list(self.histograms.items())
+        for stage, histogram in histograms:
+            name = f'{prefix}_{stage}_seconds'
+            lines.append(f'# TYPE {name} histogram')
+            total = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                total += count
+                lines.append(f'{name}_bucket{{le="{bound:.6g}"}} {total}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.n}')
+            lines.append(f'{name}_sum {histogram.sum:.9f}')
+            lines.append(f'{name}_count {histogram.n}')
+        for counter, value in list(self.counters.items()):
+            lines.append(f'# TYPE {prefix}_{counter}_total counter')
+            lines.append(f'{prefix}_{counter}_total {value}')
+        for gauge, value in list(self.gauges.items()):
+            lines.append(f'# TYPE {prefix}_{gauge} gauge')
+            lines.append(f'{prefix}_{gauge} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        writes the metrics in the text format to the given file. The file is replaced at once,
+        so readers never see a partially written file
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_text())
+        os.replace(tmp_path, path)
+
+
+class MetricsExporter:
+    """
+    Exports Metrics in the background: writes them to a file periodically and/or serves them
+    over HTTP on localhost, e.g. http://localhost:9100/metrics
+    """
+
+    def __init__(self, metrics, path=None, port=None, interval=1.0):
+        """
+        :param metrics: the Metrics to export
+        :param path: path of the metrics file, or None
+        :param port: port of the HTTP endpoint, or None
+        :param interval: time in sec between two writes of the file
+        """
+        self.metrics = metrics
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._threads = []
+        self._server = None
+
+    def start(self):
+        self._stopped.clear()
+        if self.path is not None:
+            self._threads.append(threading.Thread(target=self._write, daemon=True))
+        if self.port is not None:
+            metrics = self.metrics
+
+            class Handler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = metrics.to_text().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = http.server.ThreadingHTTPServer(('localhost', self.port), Handler)
+            self.port = self._server.server_address[1]
+            self._threads.append(threading.Thread(target=self._server.serve_forever, daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self.path is not None:
+            self.metrics.write(self.path)
+
+    def _write(self):
+        while not self._stopped.wait(self.interval):
+            self.metrics.write(self.path)
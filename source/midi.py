@@ -10,6 +10,21 @@ midi_out = rtmidi.MidiOut()
 cc_statusbyte = 0xB0
 is_mapping = False
 
+# controller numbers of the NRPN parameter number and data entry messages
+NRPN_MSB = 99
+NRPN_LSB = 98
+DATA_ENTRY_MSB = 6
+DATA_ENTRY_LSB = 38
+
+
+class Resolution:
+    CC_7BIT = 0  # one control change message, values 0-127
+    CC_14BIT = 1  # MSB on controller n and LSB on controller n + 32 (n from 0-31), values 0-16383
+    NRPN = 2  # non-registered parameter number with 14 bit data entry, values 0-16383
+
+
+MAX_VALUES = {Resolution.CC_7BIT: 127, Resolution.CC_14BIT: 16383, Resolution.NRPN: 16383}
+
 
 def open_midi_port(port_nr=1):
     """
@@ -28,34 +43,102 @@ def open_midi_port(port_nr=1):
         raise
 
 
-def send_control_change(value, control_number=1):
+def check_range(name, value, max_value):
+    """
+    raises a ValueError if value is not an integer from 0 to max_value
+    """
+    if not 0 <= value <= max_value or int(value) != value:
+        raise ValueError(f'{name} must be from 0 to {max_value}, got {value}')
+
+
+def control_change(value, control_number=1, channel=0):
+    """returns a MIDI control change message with the given value from 0-127 on the given channel from 0-15"""
+    check_range('MIDI channel', channel, 15)
+    check_range('controller number', control_number, 127)
+    check_range('value', value, 127)
+    return [cc_statusbyte | channel, control_number, value]
+
+
+def control_change_14bit(value, control_number=1, channel=0):
+    """
+    returns the MSB and LSB control change messages for the given value from 0-16383
+    :param control_number: controller number of the MSB from 0-31, the LSB is sent on control_number + 32
+    """
+    check_range('14 bit controller number', control_number, 31)
+    check_range('14 bit value', value, 16383)
+    return [control_change(value >> 7, control_number, channel),
+            control_change(value & 0x7F, control_number + 32, channel)]
+
+
+def nrpn(value, parameter, channel=0):
+    """
+    returns the control change messages that set the given NRPN parameter from 0-16383 to the value from 0-16383
+    """
+    check_range('NRPN parameter number', parameter, 16383)
+    check_range('NRPN value', value, 16383)
+    return [control_change(parameter >> 7, NRPN_MSB, channel), control_change(parameter & 0x7F, NRPN_LSB, channel),
+            control_change(value >> 7, DATA_ENTRY_MSB, channel), control_change(value & 0x7F, DATA_ENTRY_LSB, channel)]
+
+
+def messages(value, control_number=1, channel=0, resolution=Resolution.CC_7BIT):
+    """
+    :param value: value from 0 to MAX_VALUES[resolution]
+    :param control_number: controller number, or the parameter number for Resolution.NRPN
+    :return: list of the messages that send the value with the given resolution
+    """
+    if resolution == Resolution.CC_14BIT:
+        return control_change_14bit(value, control_number, channel)
+    if resolution == Resolution.NRPN:
+        return nrpn(value, control_number, channel)
+    return [control_change(value, control_number, channel)]
+
+
+def send_control_change(value, control_number=1, channel=0):
     """sends a MIDI control change message with the given value from 0-127"""
-    cchange = [cc_statusbyte, control_number, value]  # controlchange message
+    cchange = control_change(value, control_number, channel)
     midi_out.send_message(cchange)
-    print(f'sent MIDI CC message: control_number {control_number}, value {value}')
 
 
-def to_midi(x, min_, max_):
+def send_messages(message_list):
+    """sends the given messages back to back, e.g. the MSB and LSB of a 14 bit control change"""
+    send = midi_out.send_message
+    for message in message_list:
+        send(message)
+
+
+def to_midi(x, min_, max_, max_value=127):
     """
     Converts the value x into the given range from min_ to max_
+    :param max_value: the largest MIDI value, e.g. 16383 for 14 bit
+    """
+    return int(scale(x, min_, max_) * max_value)
+
+
+def scale(x, min_, max_):
+    """
+    :return: the position of x within the range from min_ to max_, from 0.0 to 1.0.
+             0.5 if the range is empty, e.g. after a calibration on flat data
     """
+    if max_ <= min_:
+        return 0.5
     if x > max_:
         x = max_
     if x < min_:
         x = min_
-    return int(x * 127 / (max_ - min_))
+    return (x - min_) / (max_ - min_)
 
 
-def start_mapping(control_number):
+def start_mapping(control_number, channel=0, resolution=Resolution.CC_7BIT):
     """
-    sends CC messages with the specified controller number until stop_mapping is called
+    sends messages with the specified controller number and resolution until stop_mapping is called,
+    so MIDI learn picks up the 14 bit pair or the NRPN
     :param control_number:
     :return:
     """
     global is_mapping
     is_mapping = True
     while is_mapping:
-        send_control_change(0, control_number)
+        send_messages(messages(0, control_number, channel, resolution))
         time.sleep(0.1)
 
 
@@ -1,5 +1,6 @@
 import sys
 import threading
+import time
 import winsound
 import os
 
@@ -7,12 +8,17 @@ import numpy as np
 import pyqtgraph as pg
 from PyQt5.QtCore import pyqtSlot, QTimer
 from PyQt5.QtGui import QColor
-from PyQt5.QtWidgets import QApplication, QCheckBox, QMessageBox, QFileDialog
+from PyQt5.QtWidgets import QApplication, QCheckBox, QMessageBox, QFileDialog, QActionGroup
 from PyQt5.uic import loadUi
 from rtmidi._rtmidi import InvalidPortError
 
+import batch
 import midi
+from midioutput import MidiOutput, Interpolation
+from plotting import ScrollingPlot
+from smoothing import SmoothingMethod
 from Processing import *
+from qthreads import ConnectionThread, ProcessingThread, CalibrationThread, RenderThread
 from Playback import EEGPlayback
 
 """
@@ -25,6 +31,8 @@ cal_gui = None
 ft_gui = None
 proc = None
 playback = None
+midi_output = None
+RECORDING_FILTER = 'EEG recording (*.mbr *.csv)'
 
 # for connection to FieldTrip
 host_name = 'localhost'
@@ -35,6 +43,9 @@ alpha_graph = None
 beta_graph = None
 alpha_plot = dict()
 beta_plot = dict()
+power_plot = None  # ScrollingPlot of the raw and averaged alpha/beta values
+plot_window = 60  # length of the plot window in sec
+y_ranges = None  # calibration the y ranges of the graphs were last set for
 
 # midi control numbers
 alpha_control_nr = 1
@@ -45,6 +56,7 @@ beta_control_nr = 2
 connection_thread = None
 processing_thread = None
 cal_thread = None
+render_thread = None
 playback_thread = None
 connect_run = threading.Event()
 proc_run = threading.Event()
@@ -82,16 +94,30 @@ def on_connection_changed(status):
     update_buttons()
     update_labels()
     update_channel_boxes()
-    update_spinboxes()
+    if not proc_run.is_set():
+        # while processing, the status changes come from its reconnects, which restarting it would abort
+        update_spinboxes()
 
 @pyqtSlot(PowerValues)
 def on_new_values(new_values):
-    print(f'received new power values: {new_values}')
-    a = midi.to_midi(new_values.av_alpha, proc.alpha_min, proc.alpha_max)
-    b = midi.to_midi(new_values.av_beta, proc.beta_min, proc.beta_max)
-    midi.send_control_change(a, 1)
-    midi.send_control_change(b, 2)
-    update_graph()
+    # the MIDI messages are sent by midi_output on its own thread, the graphs are redrawn by redraw_graph
+    proc.metrics.observe('delivery', time.perf_counter() - new_values.timestamp)
+    power_plot.append((new_values.raw_alpha, new_values.av_alpha, new_values.raw_beta, new_values.av_beta))
+
+
+def update_status_bar():
+    """
+    shows the median and 99th percentile of the stage timings and the counters in the status bar
+    """
+    if proc_run.is_set():
+        gui.statusbar.showMessage(proc.metrics.format_status())
+
+
+def save_metrics():
+    name = QFileDialog.getSaveFileName(gui, "Save performance metrics", filter='Text File (*.txt)',
+                                       initialFilter='Text File (*.txt)')[0]
+    if name:
+        proc.metrics.write(name)
 
 @pyqtSlot(int)
 def update_progbar(val):
@@ -102,28 +128,50 @@ def update_progbar(val):
         cal_gui.b_calib_button.setEnabled(True)
         winsound.MessageBeep(winsound.MB_OK)
 
-def save_data():
-    stop_processing()
-    data = proc.raw_data
-    name = QFileDialog.getSaveFileName(gui, "Save recorded EEG data", filter='Text File (*.csv)',
-                                       initialFilter='Text File (*.csv)')[0]
+def toggle_recording():
+    """
+    starts recording the incoming EEG data into a file in the background, or stops a running recording
+    """
+    if proc.recorder is not None:
+        path = proc.recorder.path
+        proc.stop_recording()
+        gui.item_save.setText('Record session')
+        show_dialog(f'Recording saved to {os.path.basename(path)}')
+        return
+    name = QFileDialog.getSaveFileName(gui, "Record EEG data", filter='MIDIBrain recording (*.mbr)',
+                                       initialFilter='MIDIBrain recording (*.mbr)')[0]
     if name:
-        np.savetxt(name, data, header=str(proc.sfreq), delimiter=",")
-    show_dialog('Successfully saved!')
+        proc.start_recording(name)
+        gui.item_save.setText('Stop recording')
+
+
+@pyqtSlot(str)
+def on_recording_stopped(path):
+    gui.item_save.setText('Record session')
+    show_dialog(f'The EEG header has changed, so the recording has been stopped. '
+                f'Recording saved to {os.path.basename(path)}')
 
 
 def load_data():
+    """
+    loads a recording for the playback, which starts with the Start button. It is calibrated from its first minute,
+    so loading does not depend on its length
+    """
     global playback, proc, host_name, port_nr, gui
+    stop_playback()
     stop_processing()
-    file_name = QFileDialog.getOpenFileName(gui, "Open recorded EEG data", filter='Text File (*.csv)', initialFilter='Text File (*.csv)')[0]
+    file_name = QFileDialog.getOpenFileName(gui, "Open recorded EEG data", filter=RECORDING_FILTER,
+                                            initialFilter=RECORDING_FILTER)[0]
+    if not file_name:
+        return
     playback = EEGPlayback(file_name, host_name, port_nr)
     playback.load_data()
     playback.connect()
     playback.playback_finished.on_change += stop_playback
-    data = playback.getAllData()
     proc.clear_vals()
+    power_plot.clear()
     proc.reset_fieldtrip_vars()
-    proc.calibrate_from_recording(data)
+    proc.calibrate_from_recording(playback.get_calibration_data())
     connect()
 
     gui.input_label_value.setText(f'playback from {os.path.basename(file_name)}')
@@ -131,6 +179,50 @@ def load_data():
 
     show_dialog('EEG recording loaded. To start playback, press Start.')
     
+def render_midi_file():
+    """
+    renders a recording into a MIDI file in the background, with the glide, average, smoothing, channels and
+    calibration that are applied to the processing
+    """
+    global render_thread
+    file_name = QFileDialog.getOpenFileName(gui, "Open recorded EEG data", filter=RECORDING_FILTER,
+                                            initialFilter=RECORDING_FILTER)[0]
+    if not file_name:
+        return
+    midi_name = QFileDialog.getSaveFileName(gui, "Save MIDI file", filter='MIDI File (*.mid)',
+                                            initialFilter='MIDI File (*.mid)')[0]
+    if not midi_name:
+        return
+    recording = EEGPlayback(file_name)
+    recording.load_data()
+    chans = [c for c in proc.active_channels if c < recording.n_channels]
+    render_proc = batch.create_processing(recording.sample_rate, recording.n_channels, chans, proc.get_glide(),
+                                          proc.get_average())
+    render_proc.alpha_min, render_proc.alpha_max = proc.alpha_min, proc.alpha_max
+    render_proc.beta_min, render_proc.beta_max = proc.beta_min, proc.beta_max
+    render_proc.smoothing = dict(proc.smoothing)
+    gui.item_render.setEnabled(False)
+    render_thread = RenderThread(render_proc, recording.recording.iter_chunks(), midi_name, alpha_control_nr,
+                                 beta_control_nr)
+    render_thread.sig_render_progress.connect(lambda n_samples: on_render_progress(n_samples, recording))
+    render_thread.sig_render_finished.connect(lambda n_steps: on_render_finished(n_steps, midi_name))
+    render_thread.start()
+
+
+def on_render_progress(n_samples, recording):
+    # the length of csv recordings is only known once they have been read
+    if recording.n_samples:
+        gui.statusbar.showMessage(f'Rendering MIDI file... {100 * n_samples // recording.n_samples}%')
+    else:
+        gui.statusbar.showMessage(f'Rendering MIDI file... {n_samples / recording.sample_rate:.0f} s')
+
+
+def on_render_finished(n_steps, midi_name):
+    gui.item_render.setEnabled(True)
+    gui.statusbar.clearMessage()
+    show_dialog(f'{n_steps} values rendered to {os.path.basename(midi_name)}')
+
+
 def unload_data():
     global playback, gui
     stop_processing()
@@ -142,7 +234,7 @@ def unload_data():
 
 
 def init_graph():
-    global gui, proc, timer, alpha_graph, beta_graph
+    global gui, proc, alpha_graph, beta_graph, power_plot
 
     pg.setConfigOptions(antialias=True)
     alpha_graph = pg.PlotWidget(name="alpha plot")
@@ -154,27 +246,55 @@ def init_graph():
     al.insertWidget(0, alpha_graph, 8)
     bl.insertWidget(0, beta_graph, 8)
     alpha_graph.getPlotItem().setTitle("Alpha waves")
-    alpha_graph.getPlotItem().vb.setLimits(xMin=0, yMin=0)
+    alpha_graph.getPlotItem().vb.setLimits(xMax=0, yMin=0)
     beta_graph.getPlotItem().setTitle("Beta waves")
-    beta_graph.getPlotItem().vb.setLimits(xMin=0, yMin=0)
+    beta_graph.getPlotItem().vb.setLimits(xMax=0, yMin=0)
     alpha_plot["raw"] = alpha_graph.getPlotItem().plot(pen=QColor(155, 155, 155), width=10)
     alpha_plot["averaged"] = alpha_graph.getPlotItem().plot(pen='b', width=10)
     beta_plot["raw"] = beta_graph.getPlotItem().plot(pen=QColor(155, 155, 155), width=50)
     beta_plot["averaged"] = beta_graph.getPlotItem().plot(pen=QColor(234, 98, 0), width=50)
     alpha_graph.setYRange(proc.alpha_min, proc.alpha_max)
     beta_graph.setYRange(proc.beta_min, proc.beta_max)
-
-
-def update_graph():
-    global alpha_graph, beta_graph
-    if proc.connection_status == ConnectionStatus.CONNECTED:
-        alpha_plot["raw"].setData(proc.power_values.raw_alpha)
-        alpha_plot["averaged"].setData(proc.power_values.av_alpha)
-        beta_plot["raw"].setData(proc.power_values.raw_beta)
-        beta_plot["averaged"].setData(proc.power_values.av_beta)
+    power_plot = ScrollingPlot([alpha_plot["raw"], alpha_plot["averaged"], beta_plot["raw"], beta_plot["averaged"]],
+                               plot_window, get_step_time())
+    set_plot_window(plot_window)
+
+
+def get_step_time():
+    """
+    :return: time in sec between two power values
+    """
+    if proc.sfreq <= 0:
+        return 1.0
+    return proc.get_step_size() / proc.sfreq
+
+
+def set_plot_window(window):
+    """
+    sets the length of the plot window in sec. The graphs are cleared
+    """
+    global plot_window
+    plot_window = window
+    power_plot.set_window(window, get_step_time())
+    alpha_graph.setXRange(-window, 0, padding=0)
+    beta_graph.setXRange(-window, 0, padding=0)
+
+
+def redraw_graph():
+    """
+    redraws the graphs if new values have arrived. Called by a timer at the display refresh rate,
+    so new values only cost appending them to the plot, no matter how fast they arrive
+    """
+    global y_ranges
+    start = time.perf_counter()
+    if not power_plot.draw():
+        return
+    calibration = (proc.alpha_min, proc.alpha_max, proc.beta_min, proc.beta_max)
+    if calibration != y_ranges:
+        y_ranges = calibration
         alpha_graph.setYRange(proc.alpha_min - proc.alpha_min * 1.1, proc.alpha_max * 1.1)
         beta_graph.setYRange(proc.beta_min - proc.beta_min * 1.1, proc.beta_max * 1.1)
-        app.processEvents()
+    proc.metrics.observe('redraw', time.perf_counter() - start)
 
 
 def init_channel_boxes():
@@ -251,15 +371,23 @@ def connect():
     connect_run.set()
     connection_thread = ConnectionThread(proc, host_name, port_nr, connect_run)
     connection_thread.sig_connection_status.connect(on_connection_changed)
+    connection_thread.sig_recording_stopped.connect(on_recording_stopped)
     connection_thread.start()
 
 def disconnect():
     if connection_thread is not None and connection_thread.isRunning():
         connect_run.clear()
         connection_thread.wait()
+    if cal_thread is not None and cal_thread.isRunning():
+        cal_thread.stop()
+        cal_thread.wait()
+        cal_gui.cal_progbar.setEnabled(False)
+        cal_gui.a_calib_button.setEnabled(True)
+        cal_gui.b_calib_button.setEnabled(True)
     if processing_thread is not None and processing_thread.isRunning():
         stop_processing()
     proc.disconnect()
+    gui.item_save.setText('Record session')
     on_connection_changed(proc.connection_status)
 
 def on_connection_error():
@@ -282,9 +410,13 @@ def on_start():
 def start_processing():
     global proc, processing_thread, proc_run
     gui.start_button.setText('Stop')
+    if power_plot.step_time != get_step_time():
+        # sampling rate or glide have changed
+        set_plot_window(plot_window)
     proc_run.set()
     processing_thread = ProcessingThread(proc, proc_run)
     processing_thread.sig_calculated_values.connect(on_new_values)
+    processing_thread.sig_recording_stopped.connect(on_recording_stopped)
     processing_thread.start()
 
 
@@ -314,7 +446,9 @@ def stop_playback():
 @pyqtSlot()
 def on_alpha_map_pressed():
     global gui
-    mapping_thread = threading.Thread(target=midi.start_mapping, args=[alpha_control_nr], daemon=True)
+    mapping_thread = threading.Thread(target=midi.start_mapping,
+                                      args=[alpha_control_nr, midi_output.channels.get('alpha', 0),
+                                            midi_output.resolution], daemon=True)
     if gui.alpha_map_button.isChecked():
         gui.beta_map_button.setEnabled(False)
         mapping_thread.start()
@@ -326,7 +460,9 @@ def on_alpha_map_pressed():
 @pyqtSlot()
 def on_beta_map_pressed():
     global gui
-    mapping_thread = threading.Thread(target=midi.start_mapping, args=[beta_control_nr])
+    mapping_thread = threading.Thread(target=midi.start_mapping,
+                                      args=[beta_control_nr, midi_output.channels.get('beta', 0),
+                                            midi_output.resolution])
     mapping_thread.daemon = True
     if gui.beta_map_button.isChecked():
         gui.alpha_map_button.setEnabled(False)
@@ -387,6 +523,20 @@ def update_spinboxes():
         start_processing()
 
 
+def set_smoothing(band, method):
+    """
+    selects the smoothing of the given band and recalibrates, as the range of the smoothed values changes with it
+    """
+    cont = False
+    if proc_run.is_set():
+        stop_processing()
+        cont = True
+    proc.set_smoothing(band, method)
+    proc.recalibrate()
+    if cont:
+        start_processing()
+
+
 @pyqtSlot(int)
 def change_average(av):
     global proc
@@ -397,8 +547,34 @@ def change_average(av):
 
 def init_menubar():
     gui.ft_item.triggered.connect(show_ft_config)
-    gui.item_save.triggered.connect(save_data)
+    gui.item_save.triggered.connect(toggle_recording)
     gui.item_open.triggered.connect(load_data)
+    gui.item_render.triggered.connect(render_midi_file)
+    gui.item_metrics.triggered.connect(save_metrics)
+    interpolation_group = QActionGroup(gui)
+    for action, interpolation in ((gui.item_interpolation_none, Interpolation.NONE),
+                                  (gui.item_interpolation_linear, Interpolation.LINEAR),
+                                  (gui.item_interpolation_exponential, Interpolation.EXPONENTIAL)):
+        interpolation_group.addAction(action)
+        action.triggered.connect(lambda checked, i=interpolation: midi_output.set_interpolation(i))
+    resolution_group = QActionGroup(gui)
+    for action, resolution in ((gui.item_resolution_7bit, midi.Resolution.CC_7BIT),
+                               (gui.item_resolution_14bit, midi.Resolution.CC_14BIT),
+                               (gui.item_resolution_nrpn, midi.Resolution.NRPN)):
+        resolution_group.addAction(action)
+        action.triggered.connect(lambda checked, r=resolution: midi_output.set_resolution(r))
+    window_group = QActionGroup(gui)
+    for action, window in ((gui.item_window_30, 30), (gui.item_window_60, 60), (gui.item_window_300, 300),
+                           (gui.item_window_600, 600)):
+        window_group.addAction(action)
+        action.triggered.connect(lambda checked, w=window: set_plot_window(w))
+    for band in ('alpha', 'beta'):
+        smoothing_group = QActionGroup(gui)
+        for name, method in (('average', SmoothingMethod.MOVING_AVERAGE), ('exponential', SmoothingMethod.EXPONENTIAL),
+                             ('median', SmoothingMethod.MEDIAN), ('one_euro', SmoothingMethod.ONE_EURO)):
+            action = getattr(gui, f'item_{band}_smoothing_{name}')
+            smoothing_group.addAction(action)
+            action.triggered.connect(lambda checked, b=band, m=method: set_smoothing(b, m))
 
 def init_buttons():
     global gui, cal_gui, ft_gui, proc
@@ -418,7 +594,7 @@ def init_buttons():
 
 
 def main():
-    global app, gui, cal_gui, ft_gui, proc
+    global app, gui, cal_gui, ft_gui, proc, midi_output
 
     #dirname = os.path.dirname(__file__)
     #demo_buffer_path = os.path.join(dirname, '../FieldTrip/demo_buffer.exe')
@@ -438,6 +614,8 @@ def main():
         midi.open_midi_port()
     except InvalidPortError:
         show_dialog("MIDI port could not be opened. Please install the LoopBe1 MIDI driver.")
+    midi_output = MidiOutput(proc, {'alpha': alpha_control_nr, 'beta': beta_control_nr}).start()
+    proc.new_values_event.on_change += midi_output.put
 
     init_buttons()
     init_menubar()
@@ -445,6 +623,12 @@ def main():
     update_labels()
     update_spinboxes()
     init_graph()
+    status_timer = QTimer()
+    status_timer.timeout.connect(update_status_bar)
+    status_timer.start(1000)
+    redraw_timer = QTimer()
+    redraw_timer.timeout.connect(redraw_graph)
+    redraw_timer.start(int(1000 / (app.primaryScreen().refreshRate() or 60)))
     connect()
 
     sys.exit(app.exec_())
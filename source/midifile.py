@@ -0,0 +1,138 @@
+import argparse
+import struct
+
+import numpy as np
+
+import midi
+
+"""
+Renders recordings into Standard MIDI Files, with the CC events at the tick of each processing step
+Usage: python midifile.py recording.csv automation.mid --glide 4 --average 20
+Author: Edward Berndt
+"""
+
+
+def variable_length(value):
+    """
+    :param value: non-negative integer
+    :return: value as variable-length quantity, as used for delta times in MIDI files
+    """
+    buf = [value & 0x7F]
+    value >>= 7
+    while value:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(buf))
+
+
+class MidiFileWriter:
+    """
+    Writes a single-track Standard MIDI File (format 0) while the events are generated.
+    The track length is filled in when the file is closed
+    """
+
+    def __init__(self, path, ppq=480, tempo=500000):
+        """
+        :param path: path of the .mid file
+        :param ppq: ticks per quarter note
+        :param tempo: microseconds per quarter note
+        """
+        self.file = open(path, 'wb')
+        self.tick = 0
+        self.file.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, ppq))
+        self.file.write(b'MTrk' + struct.pack('>I', 0))
+        self._track_start = self.file.tell()
+        self.write_meta(0, 0x51, struct.pack('>I', tempo)[1:])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_message(self, tick, message):
+        """
+        :param tick: absolute time of the message in ticks. Must not be before the previous message
+        :param message: list of MIDI bytes, e.g. from midi.control_change
+        :return:
+        """
+        self.file.write(variable_length(tick - self.tick) + bytes(message))
+        self.tick = tick
+
+    def write_meta(self, tick, meta_type, data):
+        self.write_message(tick, [0xFF, meta_type] + list(variable_length(len(data))) + list(data))
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.write_meta(self.tick, 0x2F, b'')  # end of track
+        end = self.file.tell()
+        self.file.seek(self._track_start - 4)
+        self.file.write(struct.pack('>I', end - self._track_start))
+        self.file.close()
+
+
+def render_recording(proc, chunks, path, alpha_cc=1, beta_cc=2, bpm=120, progress=None):
+    """
+    renders the alpha and beta CC values of a recording into a MIDI file, using the settings
+    and calibration of the given Processing. The recording is read chunk by chunk
+    :param proc: Processing with the sfreq of the recording
+    :param chunks: iterable of arrays of shape (samples, channels), e.g. RecordingReader.iter_chunks()
+                   or [data] for a recording in memory
+    :param path: path of the .mid file
+    :param alpha_cc: controller number for alpha power
+    :param beta_cc: controller number for beta power
+    :param bpm: tempo of the MIDI file
+    :param progress: optional function that gets called with the number of samples rendered so far
+    :return: number of processing steps that were written
+    """
+    # with one tick per sample, every step is placed exactly at the sample it was calculated at
+    ppq = int(min(max(round(proc.sfreq * 60 / bpm), 24), 0x7FFF))
+    ticks_per_sample = ppq * bpm / (60 * proc.sfreq)
+    n_steps = 0
+    with MidiFileWriter(path, ppq, int(round(60e6 / bpm))) as f:
+        for samples, values in proc.iter_recording_chunks(chunks):
+            ticks = np.round(samples * ticks_per_sample).astype(int)
+            for tick, a, b in zip(ticks, values.av_alpha, values.av_beta):
+                f.write_message(tick, midi.control_change(midi.to_midi(a, proc.alpha_min, proc.alpha_max), alpha_cc))
+                f.write_message(tick, midi.control_change(midi.to_midi(b, proc.beta_min, proc.beta_max), beta_cc))
+            n_steps += len(ticks)
+            if progress is not None:
+                progress(int(samples[-1]))
+    return n_steps
+
+
+def main(argv=None):
+    from batch import create_processing
+    from playback import EEGPlayback
+
+    parser = argparse.ArgumentParser(description='Renders an EEG recording into a MIDI file.')
+    parser.add_argument('recording', help='recording (.mbr or csv with "# sfreq" as first line)')
+    parser.add_argument('output', help='path of the .mid file')
+    parser.add_argument('--channels', type=int, nargs='*', help='numbers of the channels to use. Default: all')
+    parser.add_argument('--glide', type=int, default=1, help='number of steps per block')
+    parser.add_argument('--average', type=int, default=20, help='length of the moving average')
+    parser.add_argument('--calibration-file', help='recording whose first minute is used for the calibration. Default: the recording itself')
+    parser.add_argument('--bpm', type=float, default=120, help='tempo of the MIDI file')
+    parser.add_argument('--alpha-cc', type=int, default=1, help='controller number for alpha power')
+    parser.add_argument('--beta-cc', type=int, default=2, help='controller number for beta power')
+    args = parser.parse_args(argv)
+
+    # the recording is read chunk by chunk, only the calibration data is held in memory
+    recording = EEGPlayback(args.recording)
+    recording.load_data()
+    proc = create_processing(recording.sample_rate, recording.n_channels, args.channels, args.glide, args.average)
+    calibration = recording
+    if args.calibration_file:
+        calibration = EEGPlayback(args.calibration_file)
+        calibration.load_data()
+    proc.cal_alpha = calibration.get_calibration_data()
+    proc.cal_beta = proc.cal_alpha
+    proc.recalibrate()
+    n_steps = render_recording(proc, recording.recording.iter_chunks(), args.output, args.alpha_cc, args.beta_cc,
+                               args.bpm)
+    print(f'{n_steps} steps written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+import collections
+import math
+import threading
+import time
+
+import midi
+
+"""
+Sends the calculated power values as MIDI CC messages on a dedicated thread
+Author: Edward Berndt
+"""
+
+
+class Interpolation:
+    NONE = 0  # every value is sent as soon as it has been calculated
+    LINEAR = 1  # ramps linearly to the latest value within one step of the processing
+    EXPONENTIAL = 2  # approaches the latest value exponentially, covering 95% within one step of the processing
+
+
+class MidiOutput:
+    """
+    Receives new power values directly from the processing and sends them on its own thread,
+    so the MIDI timing neither depends on the processing loop nor on the GUI.
+    Values are handed over through a deque, which appends and pops atomically without a lock.
+    Only the latest values are sent, messages with an unchanged value are dropped and every controller
+    sends at most max_rate messages per second.
+    With interpolation, every controller ramps towards the latest value on a timer ticking max_rate times
+    per second, so the controlled parameter moves smoothly instead of jumping once per step.
+    Values are sent as 7 bit or 14 bit control changes or as NRPN, see midi.Resolution.
+    """
+
+    def __init__(self, processing, control_numbers=None, max_rate=100.0, interpolation=Interpolation.NONE,
+                 channels=None, resolution=midi.Resolution.CC_7BIT):
+        """
+        :param processing: the Processing whose calibration is used to convert the values
+        :param control_numbers: dict with the controller (or NRPN parameter) number of every band.
+                                Default: alpha 1, beta 2
+        :param max_rate: maximum number of messages per second and controller
+        :param interpolation: see Interpolation
+        :param channels: dict with the MIDI channel (0-15) of every band. Default: channel 0
+        :param resolution: see midi.Resolution
+        """
+        self.processing = processing
+        self.control_numbers = dict(control_numbers or {'alpha': 1, 'beta': 2})
+        self.channels = dict(channels or {})
+        self.max_rate = max_rate
+        self.interpolation = interpolation
+        self.resolution = resolution
+        self.last_values = dict()  # last sent value of every band
+        self.last_sent = dict()  # time.perf_counter() of the last message of every band
+        self._ramps = dict()  # band -> [start value, target value, start time, current value]
+        self._nrpn_parameters = dict()  # channel -> currently selected NRPN parameter
+        self._queue = collections.deque(maxlen=64)
+        self._wakeup = threading.Event()
+        self._running = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        starts the output thread
+        :return: self
+        """
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running.clear()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def put(self, new_values):
+        """
+        hands new values over to the output thread. Can be subscribed to Processing.new_values_event
+        :param new_values: PowerValues with a single set of values
+        """
+        self._queue.append(new_values)
+        self._wakeup.set()
+
+    def set_resolution(self, resolution):
+        """
+        :param resolution: see midi.Resolution
+        """
+        if resolution == midi.Resolution.CC_14BIT and max(self.control_numbers.values()) > 31:
+            raise ValueError('14 bit control changes need controller numbers from 0 to 31')
+        self.resolution = resolution
+        self.last_values.clear()
+        self._ramps.clear()
+        self._nrpn_parameters.clear()
+
+    def set_interpolation(self, interpolation):
+        self.interpolation = interpolation
+        self._wakeup.set()
+
+    def get_ramp_time(self):
+        """
+        :return: duration of a ramp in sec, equal to the time between two steps of the processing
+        """
+        if self.processing.sfreq <= 0:
+            return 1 / self.max_rate
+        return self.processing.get_step_size() / self.processing.sfreq
+
+    def _run(self):
+        while self._running.is_set():
+            try:
+                if self.interpolation == Interpolation.NONE:
+                    self._run_direct()
+                else:
+                    self._run_ramps()
+            except Exception as e:
+                # the value that caused the error is dropped, the output goes on with the next ones
+                print(f'MIDI output error: {e!r}')
+                self.processing.metrics.increment('midi_errors')
+
+    def _get_latest(self):
+        """
+        :return: the latest values handed over by put, or None if there are no new values
+        """
+        new_values = None
+        while self._queue:
+            new_values = self._queue.popleft()
+        return new_values
+
+    def _to_midi(self, band, new_values):
+        return midi.to_midi(getattr(new_values, 'av_' + band), getattr(self.processing, band + '_min'),
+                            getattr(self.processing, band + '_max'), midi.MAX_VALUES[self.resolution])
+
+    def _to_position(self, band, new_values):
+        """
+        :return: the value of the band as float from 0.0 to the maximum value of the resolution
+        """
+        return midi.scale(getattr(new_values, 'av_' + band), getattr(self.processing, band + '_min'),
+                          getattr(self.processing, band + '_max')) * midi.MAX_VALUES[self.resolution]
+
+    def _run_direct(self):
+        pending = dict()  # band -> (value, time the values were calculated)
+        while self._running.is_set() and self.interpolation == Interpolation.NONE:
+            self._wakeup.wait(self._get_timeout(pending))
+            self._wakeup.clear()
+            new_values = self._get_latest()
+            if new_values is not None:
+                for band in list(self.control_numbers):
+                    pending[band] = (self._to_midi(band, new_values), new_values.timestamp)
+            self._send_pending(pending)
+
+    def _get_timeout(self, pending):
+        """
+        :return: time in sec until the next pending message may be sent, or None if nothing is pending
+        """
+        if not pending:
+            return None
+        now = time.perf_counter()
+        return max(min(self.last_sent.get(band, 0) + 1 / self.max_rate for band in pending) - now, 0)
+
+    def _send_pending(self, pending):
+        for band, (value, timestamp) in list(pending.items()):
+            if self.last_values.get(band) == value:
+                del pending[band]
+                self.processing.metrics.increment('midi_unchanged')
+                continue
+            if time.perf_counter() - self.last_sent.get(band, 0) < 1 / self.max_rate:
+                continue  # rate limited, sent as soon as allowed
+            self._send(band, value, timestamp)
+            del pending[band]
+
+    def _get_messages(self, band, value):
+        """
+        :return: the messages that send the value of the band with the current resolution.
+                 The NRPN parameter is only selected if another parameter has been selected on the channel before
+        """
+        channel = self.channels.get(band, 0)
+        control_number = self.control_numbers[band]
+        messages = midi.messages(value, control_number, channel, self.resolution)
+        if self.resolution == midi.Resolution.NRPN:
+            if self._nrpn_parameters.get(channel) == control_number:
+                messages = messages[2:]
+            self._nrpn_parameters[channel] = control_number
+        return messages
+
+    def _send(self, band, value, timestamp=None):
+        """
+        sends the value of the band and records its timing. All messages of the value are sent back to back
+        :param timestamp: time the sent values were calculated, if this is the first message for them
+        """
+        messages = self._get_messages(band, value)
+        start = time.perf_counter()
+        midi.send_messages(messages)
+        sent = time.perf_counter()
+        self.last_values[band] = value
+        self.last_sent[band] = sent
+        metrics = self.processing.metrics
+        metrics.observe('midi', sent - start)
+        if timestamp is not None:
+            metrics.observe('output', sent - timestamp)
+        metrics.increment('midi_messages')
+
+    def _run_ramps(self):
+        """
+        ticks max_rate times per second on the monotonic clock and moves every controller along its ramp.
+        Ticks that were missed are skipped instead of being sent in a burst
+        """
+        interval = 1 / self.max_rate
+        next_tick = time.perf_counter()
+        timestamps = dict()  # band -> time the latest target was calculated, until it is first sent
+        while self._running.is_set() and self.interpolation != Interpolation.NONE:
+            self._sleep_until(next_tick)
+            now = time.perf_counter()
+            next_tick = max(next_tick + interval, now)
+            new_values = self._get_latest()
+            if new_values is not None:
+                for band in list(self.control_numbers):
+                    self._set_target(band, self._to_position(band, new_values), now)
+                    timestamps[band] = new_values.timestamp
+            for band, ramp in list(self._ramps.items()):
+                value = int(self._advance(ramp, now, interval))
+                if self.last_values.get(band) != value:
+                    self._send(band, value, timestamps.pop(band, None))
+
+    def _set_target(self, band, target, now):
+        ramp = self._ramps.get(band)
+        if ramp is None:
+            # nothing to ramp from yet
+            self._ramps[band] = [target, target, now, target]
+        else:
+            self._ramps[band] = [ramp[3], target, now, ramp[3]]
+
+    def _advance(self, ramp, now, interval):
+        """
+        moves the ramp to the given time
+        :return: the current value
+        """
+        start_value, target, start_time, current = ramp
+        ramp_time = self.get_ramp_time()
+        if self.interpolation == Interpolation.LINEAR:
+            progress = min((now - start_time) / ramp_time, 1.0) if ramp_time > 0 else 1.0
+            current = start_value + (target - start_value) * progress
+        else:
+            # time constant, so that 95% of the distance are covered within ramp_time
+            alpha = 1 - math.exp(-3 * interval / ramp_time) if ramp_time > 0 else 1.0
+            current += (target - current) * alpha
+            if abs(target - current) < 0.5:
+                # less than half a step of the resolution left, which would only be approached asymptotically
+                current = target
+        ramp[3] = current
+        return current
+
+    def _sleep_until(self, deadline):
+        # time.sleep has sub-millisecond resolution, unlike waiting on an event on some platforms
+        while self._running.is_set():
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.05))
@@ -2,83 +2,216 @@ import time
 import numpy as np
 import pandas as pd
 import FieldTrip
+import recorder
 from events import Events
 
 """
 Author: Edward Berndt
 """
 
+
+class CsvRecording:
+    """
+    Parses a csv recording with "# sfreq" as first line in chunks, so the file never has to be held
+    in memory as text. The number of samples is unknown until the file has been read once.
+    """
+
+    def __init__(self, path, chunk_size=65536):
+        """
+        :param path: path of the csv file
+        :param chunk_size: number of lines that are parsed at once
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.n_samples = None
+        with open(path, 'r') as f:
+            # Parse sample rate from first line (e.g., "# 512.0")
+            self.sfreq = float(f.readline().strip().lstrip('#').strip())
+            first_line = f.readline()
+        self.n_channels = len(first_line.split(',')) if first_line.strip() else 0
+        self.labels = [f"chan{i+1}" for i in range(self.n_channels)]
+
+    def iter_chunks(self):
+        """
+        yields the samples as float32 arrays of up to chunk_size samples
+        """
+        n_samples = 0
+        with pd.read_csv(self.path, header=None, skiprows=1, dtype=np.float32,
+                         chunksize=self.chunk_size) as reader:
+            for chunk in reader:
+                samples = chunk.values
+                n_samples += len(samples)
+                yield samples
+        self.n_samples = n_samples
+
+    def read(self, start, stop):
+        """
+        parses the file up to stop, the rest of it is not read
+        :param start: index of the first sample
+        :param stop: index after the last sample
+        :return: array of shape (samples, channels)
+        """
+        parts = []
+        pos = 0
+        chunks = self.iter_chunks()
+        for chunk in chunks:
+            if pos + len(chunk) > start:
+                parts.append(chunk[max(start - pos, 0):stop - pos])
+            pos += len(chunk)
+            if pos >= stop:
+                break
+        chunks.close()
+        if len(parts) == 0:
+            return np.zeros((0, self.n_channels), dtype=np.float32)
+        return np.concatenate(parts)
+
+    def read_all(self):
+        """
+        :return: all samples as array of shape (samples, channels)
+        """
+        chunks = list(self.iter_chunks())
+        if len(chunks) == 0:
+            return np.zeros((0, self.n_channels), dtype=np.float32)
+        return np.concatenate(chunks)
+
+
 class EEGPlayback:
-    def __init__(self, csv_path, host='localhost', port=1972):
+    def __init__(self, csv_path, host='localhost', port=1972, chunk_size=16, speed=1.0):
+        """
+        :param csv_path: path of the recording
+        :param chunk_size: number of samples that are sent at once
+        :param speed: playback speed relative to the sampling rate, e.g. 0.5, 1 or 10.
+                      None or 0 sends as fast as possible
+        """
         self.csv_path = csv_path
         self.host = host
         self.port = port
+        self.chunk_size = chunk_size
+        self.speed = speed
         self.__ftc = FieldTrip.Client()
         self.playback_finished = Events()
 
     def load_data(self):
-        with open(self.csv_path, 'r') as f:
-            lines = f.readlines()
-
-        # Parse sample rate from first line (e.g., "# 512.0")
-        self.sample_rate = float(lines[0].strip().lstrip('#').strip())
+        """
+        opens the recording. Only the header is read here, the samples are read on demand.
+        Supports recordings written by SessionRecorder and csv files with "# sfreq" as first line
+        """
+        if recorder.is_recording(self.csv_path):
+            self.recording = recorder.RecordingReader(self.csv_path)
+        else:
+            self.recording = CsvRecording(self.csv_path)
+        self.sample_rate = self.recording.sfreq
+        self.n_channels = self.recording.n_channels
+        self.labels = self.recording.labels
+        self.n_samples = self.recording.n_samples if isinstance(self.recording, CsvRecording) \
+            else len(self.recording)
 
-        # Load EEG data (remaining lines)
-        from io import StringIO
-        data_str = ''.join(lines[1:])
-        self.data = pd.read_csv(StringIO(data_str), header=None).values.astype(np.float32)
-        self.n_samples, self.n_channels = self.data.shape
+    def iter_blocks(self, block_size):
+        """
+        yields the recording in blocks of block_size samples, reading the file chunk by chunk.
+        Samples after the last complete block are dropped
+        """
+        pending = []
+        n_pending = 0
+        for chunk in self.recording.iter_chunks():
+            pending.append(chunk)
+            n_pending += len(chunk)
+            if n_pending < block_size:
+                continue
+            samples = np.concatenate(pending) if len(pending) > 1 else pending[0]
+            n_blocks = len(samples) // block_size
+            for i in range(n_blocks):
+                yield samples[i * block_size:(i + 1) * block_size, :]
+            rest = samples[n_blocks * block_size:, :]
+            pending = [rest]
+            n_pending = len(rest)
 
     def connect(self):
         print(f"Connecting to FieldTrip buffer at {self.host}:{self.port}...")
         self.__ftc.connect(self.host, self.port)
 
         print("Sending header...")
-        labels = [f"chan{i+1}" for i in range(self.n_channels)]
         self.__ftc.putHeader(
             nChannels=self.n_channels,
             fSample=self.sample_rate,
             dataType=FieldTrip.DATATYPE_FLOAT32,
-            labels=labels
+            labels=self.labels
         )
 
     def stream(self, running):
-        block_size = int(self.sample_rate)
-        total_blocks = self.n_samples // block_size
-        print(f"Streaming {total_blocks} blocks of {block_size} samples...")
-
-        for i in range(total_blocks):
-            if running.is_set():
-                block = self.data[i * block_size:(i + 1) * block_size, :]
-                self.__ftc.putData(block)
-                print(f"Block {i+1}/{total_blocks} sent.")
-                time.sleep(1.0)  # Simulate real-time streaming
-            else:
+        """
+        sends the recording in chunks of chunk_size samples. The chunks are scheduled on the monotonic clock,
+        so the number of sent samples stays locked to the elapsed time times sample_rate * speed,
+        independent of how long sending takes. If sending fell behind, chunks are sent without pause until
+        playback has caught up
+        :param running: threading.Event, playback stops as soon as it is cleared
+        """
+        chunk_size = int(self.chunk_size)
+        rate = self.sample_rate * self.speed if self.speed else None
+        duration = '?' if self.n_samples is None else f'{self.n_samples / self.sample_rate:.1f}'
+        print(f"Streaming {duration} sec in chunks of {chunk_size} samples at speed {self.speed or 'max'}...")
+
+        n_sent = 0
+        start = time.monotonic()
+        for chunk in self.iter_blocks(chunk_size):
+            if rate is not None:
+                # the chunk is due as soon as its last sample has been recorded
+                self._sleep_until(start + (n_sent + chunk_size) / rate, running)
+            if not running.is_set():
                 print('Playback aborted')
                 return
+            self.__ftc.putData(chunk)
+            n_sent += chunk_size
 
-        print("All blocks sent.")
+        print(f"All {n_sent} samples sent in {time.monotonic() - start:.1f} sec.")
         self.playback_finished.on_change()
 
+    @staticmethod
+    def _sleep_until(deadline, running):
+        while running.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.05))
+
     def disconnect(self):
         self.__ftc.disconnect()
         print("Disconnected from FieldTrip buffer.")
 
+    def get_calibration_data(self, duration=60):
+        """
+        :param duration: length of the calibration data in sec, like a live calibration
+        :return: the first duration sec of the recording as float32 array of shape (samples, channels).
+                 Only this part of the file is read
+        """
+        return self.recording.read(0, int(duration * self.sample_rate))
+
     def getAllData(self):
-        return self.data
+        """
+        :return: all samples as float32 array of shape (samples, channels). Reads the whole recording
+        """
+        return self.recording.read_all()
 
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) < 2:
-        print("Usage: python playback.py <eeg_csv_file> [hostname] [port]")
-        sys.exit(1)
+    import argparse
+    import threading
 
-    csv_path = sys.argv[1]
-    hostname = sys.argv[2] if len(sys.argv) > 2 else 'localhost'
-    port = int(sys.argv[3]) if len(sys.argv) > 3 else 1972
+    parser = argparse.ArgumentParser(description='Replays a recording into a FieldTrip buffer.')
+    parser.add_argument('recording', help='recording (.mbr or csv with "# sfreq" as first line)')
+    parser.add_argument('hostname', nargs='?', default='localhost', help='hostname of the FieldTrip buffer')
+    parser.add_argument('port', nargs='?', type=int, default=1972, help='port of the FieldTrip buffer')
+    parser.add_argument('--chunk-size', type=int, default=16, help='number of samples sent at once')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='playback speed, e.g. 0.5, 1 or 10. 0 sends as fast as possible')
+    args = parser.parse_args()
 
-    player = EEGPlayback(csv_path, hostname, port)
+    running = threading.Event()
+    running.set()
+    player = EEGPlayback(args.recording, args.hostname, args.port, args.chunk_size, args.speed)
     player.load_data()
     player.connect()
-    player.stream()
+    try:
+        player.stream(running)
+    except KeyboardInterrupt:
+        print('Playback aborted')
     player.disconnect()
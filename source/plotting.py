@@ -0,0 +1,92 @@
+import numpy as np
+
+from buffers import SampleBuffer
+
+"""
+Scrolling plots of the power values. Only the values inside the plot window are kept, and before drawing
+they are reduced to the minimum and maximum of every bin, so a long window draws no more points than fit the plot
+Author: Edward Berndt
+"""
+
+
+def decimate_minmax(y, n_bins, first_index=0):
+    """
+    reduces y to the minimum and maximum of every bin, so peaks stay visible when zoomed out.
+    Bins are aligned to the absolute index of the values, so they do not shift while the plot scrolls
+    :param y: array of shape (values, curves)
+    :param n_bins: maximum number of bins
+    :param first_index: absolute index of the first value
+    :return: indices of the kept values relative to the first value and the values, at most 2 per bin and curve
+    """
+    n = len(y)
+    bin_size = int(np.ceil(n / n_bins)) if n_bins > 0 else n
+    if bin_size <= 2:
+        return np.arange(n), y
+    start = -first_index % bin_size
+    n_full = (n - start) // bin_size
+    stop = start + n_full * bin_size
+    bins = y[start:stop].reshape(n_full, bin_size, -1)
+    decimated = np.empty((2 * n_full, y.shape[1]), dtype=y.dtype)
+    decimated[0::2] = bins.min(axis=1)
+    decimated[1::2] = bins.max(axis=1)
+    x = np.repeat(np.arange(start, stop, bin_size), 2)
+    x[1::2] += bin_size - 1
+    # the incomplete bins at both ends are drawn as they are
+    return np.concatenate((np.arange(start), x, np.arange(stop, n))), np.concatenate((y[:start], decimated, y[stop:]))
+
+
+class ScrollingPlot:
+    """
+    Holds the latest values of a few curves for a plot window of fixed length and draws them on demand.
+    Appending only marks the plot as changed, drawing is left to a timer running at the display rate,
+    so the plot is redrawn at most once per frame, no matter how fast new values arrive.
+    """
+
+    def __init__(self, curves, window, step_time, max_points=1000):
+        """
+        :param curves: list of pyqtgraph PlotDataItems, one per column of the appended values
+        :param window: length of the plot window in sec
+        :param step_time: time in sec between two values
+        :param max_points: maximum number of points per curve before the values get decimated
+        """
+        self.curves = curves
+        self.max_points = max_points
+        self.changed = False
+        self.set_window(window, step_time)
+
+    def set_window(self, window, step_time):
+        """
+        sets the length of the plot window and the time between two values. The plot is cleared
+        """
+        self.window = window
+        self.step_time = step_time
+        self._buffer = SampleBuffer(max(int(np.ceil(window / step_time)), 1), len(self.curves))
+        self.changed = True
+
+    def clear(self):
+        self._buffer = SampleBuffer(self._buffer.capacity, len(self.curves))
+        self.changed = True
+
+    def append(self, values):
+        """
+        :param values: one value per curve
+        """
+        self._buffer.append(np.array([values], dtype=float))
+        self.changed = True
+
+    def draw(self):
+        """
+        sets the data of the curves if values have been appended since the last call.
+        The x axis shows the time in sec relative to the latest value
+        :return: True if the curves have been redrawn
+        """
+        if not self.changed:
+            return False
+        self.changed = False
+        y = self._buffer.latest(len(self._buffer))
+        first_index = self._buffer.n_appended - len(y)
+        x, y = decimate_minmax(y, self.max_points // 2, first_index)
+        x = (x - (len(self._buffer) - 1)) * self.step_time
+        for i, curve in enumerate(self.curves):
+            curve.setData(x, y[:, i])
+        return True
@@ -0,0 +1,114 @@
+import threading
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+import midifile
+from Processing import PowerValues
+
+"""
+Qt threads running the processing in the background of the GUI
+Author: Edward Berndt
+"""
+
+
+class ConnectionThread(QThread):
+    sig_connection_status = pyqtSignal(int) # ConnectionStatus
+    sig_recording_stopped = pyqtSignal(str)  # path of the recording file
+
+    def __init__(self, processing, hostname, port_nr, connect_run, parent=None):
+        super(ConnectionThread, self).__init__(parent)
+        self.processing = processing
+        self.hostname = hostname
+        self.port_nr = port_nr
+        self.connect_run = connect_run
+
+    def run(self):
+        self.processing.connection_changed.on_change += self.on_connection_changed
+        self.processing.recording_stopped.on_change += self.on_recording_stopped
+        self.processing.connect(self.hostname, self.port_nr, self.connect_run)
+        self.processing.recording_stopped.on_change -= self.on_recording_stopped
+
+    def on_connection_changed(self, status):
+        self.sig_connection_status.emit(status)
+
+    def on_recording_stopped(self, path):
+        self.sig_recording_stopped.emit(path)
+
+
+class ProcessingThread(QThread):
+    sig_calculated_values = pyqtSignal(PowerValues)
+    sig_recording_stopped = pyqtSignal(str)  # path of the recording file, e.g. after a new header on a reconnect
+
+    def __init__(self, processing, proc_run, parent=None):
+        super(ProcessingThread, self).__init__(parent)
+        self.processing = processing
+        self.proc_run = proc_run
+
+    def run(self):
+        self.processing.new_values_event.on_change += self.on_new_values
+        self.processing.recording_stopped.on_change += self.on_recording_stopped
+        self.processing.start_processing(self.proc_run)
+        # otherwise every finished thread would keep emitting the values of the next run
+        self.processing.new_values_event.on_change -= self.on_new_values
+        self.processing.recording_stopped.on_change -= self.on_recording_stopped
+    
+    def on_new_values(self, new_values):
+        self.sig_calculated_values.emit(new_values)
+
+    def on_recording_stopped(self, path):
+        self.sig_recording_stopped.emit(path)
+
+
+class CalibrationThread(QThread):
+    sig_calibration_progress = pyqtSignal(int)
+
+    def __init__(self, processing, alpha, beta, parent=None):
+        super(CalibrationThread, self).__init__(parent)
+        self.processing = processing
+        self.alpha = alpha
+        self.beta = beta
+        self.cal_run = threading.Event()
+        self.cal_run.set()
+        self.start()
+
+    def stop(self):
+        """
+        aborts a running calibration. The previous calibration values are kept
+        :return:
+        """
+        self.cal_run.clear()
+
+    def run(self):
+        self.calibrate(self.alpha, self.beta)
+
+    def calibrate(self, cal_a, cal_b):
+        """
+        records one minute of raw data, that gets used to calibrate the min and max values of the alpha/beta power
+        :param cal_a: if True, the recorded data gets used to calibrate alpha power
+        :param cal_b: if True, the recorded data gets used to calibrate beta power
+        :return:
+        """
+        self.processing.calibrate(cal_a, cal_b, self.cal_run, self.sig_calibration_progress.emit)
+
+
+class RenderThread(QThread):
+    sig_render_progress = pyqtSignal(int)  # number of samples rendered so far
+    sig_render_finished = pyqtSignal(int)  # number of rendered steps
+
+    def __init__(self, processing, chunks, path, alpha_cc, beta_cc, parent=None):
+        """
+        :param processing: Processing with the settings and calibration to render with
+        :param chunks: iterable of arrays of shape (samples, channels), e.g. RecordingReader.iter_chunks()
+        :param path: path of the .mid file
+        """
+        super(RenderThread, self).__init__(parent)
+        self.processing = processing
+        self.chunks = chunks
+        self.path = path
+        self.alpha_cc = alpha_cc
+        self.beta_cc = beta_cc
+
+    def run(self):
+        n_steps = midifile.render_recording(self.processing, self.chunks, self.path, self.alpha_cc, self.beta_cc,
+                                            progress=self.sig_render_progress.emit)
+        self.sig_render_finished.emit(n_steps)
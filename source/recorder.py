@@ -0,0 +1,244 @@
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+"""
+Streaming recorder for EEG sessions in a chunked binary format:
+
+header: magic b'MBRC', version (uint16), flags (uint16), sfreq (float64), number of channels (uint32),
+        then for every channel the length of its label (uint16) and the utf-8 encoded label
+chunks: block index (uint64), index of the first sample (uint64), number of samples (uint32),
+        payload size in bytes (uint32), then the payload: little-endian float32 samples x channels,
+        zlib-compressed if FLAG_COMPRESSED is set
+
+Author: Edward Berndt
+"""
+
+MAGIC = b'MBRC'
+VERSION = 1
+FLAG_COMPRESSED = 0x1
+HEADER_FORMAT = '<4sHHdI'
+LABEL_FORMAT = '<H'
+CHUNK_FORMAT = '<QQII'
+DTYPE = np.dtype('<f4')
+
+
+def pack_header(sfreq, labels, compress=False):
+    """
+    :return: the header of a recording as bytes
+    """
+    flags = FLAG_COMPRESSED if compress else 0
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, flags, sfreq, len(labels))
+    for label in labels:
+        encoded = label.encode('utf-8')
+        header += struct.pack(LABEL_FORMAT, len(encoded)) + encoded
+    return header
+
+
+def pack_chunk(block_index, first_sample, samples, compress=False):
+    """
+    :param block_index: number of the chunk within the recording
+    :param first_sample: index of the first sample within the session
+    :param samples: array of shape (samples, channels)
+    :param compress: if True, the samples get compressed with zlib
+    :return: the chunk as bytes
+    """
+    payload = np.ascontiguousarray(samples, dtype=DTYPE).tobytes()
+    if compress:
+        payload = zlib.compress(payload, 1)
+    return struct.pack(CHUNK_FORMAT, block_index, first_sample, len(samples), len(payload)) + payload
+
+
+class SessionRecorder:
+    """
+    Appends incoming blocks to a recording file while the processing runs.
+    Converting, compressing, writing and flushing happens on a background thread,
+    so append only costs a copy of the samples on the calling thread.
+    """
+
+    def __init__(self, path, sfreq, labels, compress=False, flush_interval=1.0):
+        """
+        :param path: path of the recording file
+        :param sfreq: sampling frequency
+        :param labels: list with the label of every channel
+        :param compress: if True, the chunks get compressed with zlib
+        :param flush_interval: maximum time in sec that written chunks are kept in the file buffer
+        """
+        self.path = path
+        self.sfreq = sfreq
+        self.labels = list(labels)
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.n_blocks = 0
+        self.n_samples = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._file = None
+
+    def start(self):
+        """
+        creates the file, writes the header and starts the writer thread
+        :return:
+        """
+        self._file = open(self.path, 'wb')
+        self._file.write(pack_header(self.sfreq, self.labels, self.compress))
+        self._file.flush()
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def append(self, samples, first_sample=None):
+        """
+        queues the given samples for writing
+        :param samples: array of shape (samples, channels)
+        :param first_sample: index of the first sample within the session. Default: directly after the previous block
+        :return:
+        """
+        if len(samples) == 0:
+            return
+        if first_sample is None:
+            first_sample = self.n_samples
+        self._queue.put((self.n_blocks, first_sample, np.array(samples, dtype=DTYPE)))
+        self.n_blocks += 1
+        self.n_samples = first_sample + len(samples)
+
+    def stop(self):
+        """
+        writes all queued blocks, then closes the file
+        :return:
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+    def _write(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            if item:
+                self._file.write(pack_chunk(*item, compress=self.compress))
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self._file.flush()
+                last_flush = time.monotonic()
+        self._file.flush()
+
+
+class RecordingReader:
+    """
+    Reads a recording written by SessionRecorder lazily: the file is memory-mapped and only an index
+    of the chunks is built when opening it. Samples are read (and decompressed) on demand, so opening
+    a recording is fast and does not depend on its size. Samples are numbered in the order they were recorded.
+    A truncated last chunk, e.g. after a crash, is ignored.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the recording file
+        """
+        self.path = path
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        magic, version, flags, self.sfreq, self.n_channels = struct.unpack_from(HEADER_FORMAT, self._map)
+        if magic != MAGIC:
+            raise IOError(f'{path} is not a MIDIBrain recording')
+        if version != VERSION:
+            raise IOError(f'Unsupported recording version {version}')
+        self.compressed = bool(flags & FLAG_COMPRESSED)
+        offset = struct.calcsize(HEADER_FORMAT)
+        self.labels = []
+        for i in range(self.n_channels):
+            (length,) = struct.unpack_from(LABEL_FORMAT, self._map, offset)
+            offset += struct.calcsize(LABEL_FORMAT)
+            self.labels.append(bytes(self._map[offset:offset + length]).decode('utf-8'))
+            offset += length
+        self._build_index(offset)
+
+    def __len__(self):
+        return int(self._ends[-1]) if len(self._ends) > 0 else 0
+
+    def _build_index(self, offset):
+        chunk_size = struct.calcsize(CHUNK_FORMAT)
+        sample_size = self.n_channels * DTYPE.itemsize
+        offsets, first_samples, lengths, sizes = [], [], [], []
+        while offset + chunk_size <= len(self._map):
+            _, first_sample, n, size = struct.unpack_from(CHUNK_FORMAT, self._map, offset)
+            offset += chunk_size
+            if offset + size > len(self._map) or (not self.compressed and size != n * sample_size):
+                break
+            offsets.append(offset)
+            first_samples.append(first_sample)
+            lengths.append(n)
+            sizes.append(size)
+            offset += size
+        self._offsets = np.array(offsets, dtype=np.int64)
+        self._sizes = np.array(sizes, dtype=np.int64)
+        self._lengths = np.array(lengths, dtype=np.int64)
+        self._ends = np.cumsum(self._lengths)
+        # index of the first sample of every chunk within the session, as recorded
+        self.first_samples = np.array(first_samples, dtype=np.int64)
+
+    def get_chunk(self, i):
+        """
+        :param i: number of the chunk
+        :return: the samples of the chunk as array of shape (samples, channels). Uncompressed chunks are
+                 read-only views on the file
+        """
+        payload = self._map[self._offsets[i]:self._offsets[i] + self._sizes[i]]
+        if self.compressed:
+            payload = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+        return payload.view(DTYPE).reshape(int(self._lengths[i]), self.n_channels)
+
+    def iter_chunks(self):
+        """
+        yields the samples chunk by chunk
+        """
+        for i in range(len(self._offsets)):
+            yield self.get_chunk(i)
+
+    def read(self, start, stop):
+        """
+        :param start: index of the first sample
+        :param stop: index after the last sample
+        :return: array of shape (samples, channels)
+        """
+        start, stop = max(int(start), 0), min(int(stop), len(self))
+        out = np.zeros((max(stop - start, 0), self.n_channels), dtype=DTYPE)
+        if stop <= start:
+            return out
+        first = int(np.searchsorted(self._ends, start, side='right'))
+        pos = start
+        for i in range(first, len(self._ends)):
+            if pos >= stop:
+                break
+            chunk_start = int(self._ends[i] - self._lengths[i])
+            chunk = self.get_chunk(i)[pos - chunk_start:stop - chunk_start]
+            out[pos - start:pos - start + len(chunk)] = chunk
+            pos += len(chunk)
+        return out
+
+    def read_all(self):
+        """
+        :return: all samples as array of shape (samples, channels)
+        """
+        return self.read(0, len(self))
+
+    def close(self):
+        self._map = None
+
+
+def is_recording(path):
+    """
+    :return: True if the file at path is a recording written by SessionRecorder
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
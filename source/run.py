@@ -0,0 +1,157 @@
+import argparse
+import signal
+import threading
+
+import numpy as np
+
+import midi
+from metrics import MetricsExporter
+from midioutput import MidiOutput, Interpolation
+from Processing import Processing
+from smoothing import SmoothingMethod
+from spectral import SpectralMethod
+
+"""
+Headless MIDIBrain without GUI: FieldTrip buffer -> Processing -> MIDI CC
+Usage: python run.py --host localhost --port 1972 --channels 0 1 2 --glide 4 --average 20
+Author: Edward Berndt
+"""
+
+
+SMOOTHING_METHODS = {'average': SmoothingMethod.MOVING_AVERAGE, 'exponential': SmoothingMethod.EXPONENTIAL,
+                     'median': SmoothingMethod.MEDIAN, 'one-euro': SmoothingMethod.ONE_EURO}
+
+# largest controller (or NRPN parameter) number of every resolution
+MAX_CONTROL_NUMBERS = {'7bit': (127, '7 bit control changes'), '14bit': (31, '14 bit control changes'),
+                       'nrpn': (16383, 'NRPN')}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Runs the MIDIBrain processing without GUI.')
+    parser.add_argument('--host', default='localhost', help='hostname of the FieldTrip buffer')
+    parser.add_argument('--port', type=int, default=1972, help='port of the FieldTrip buffer')
+    parser.add_argument('--channels', type=int, nargs='*',
+                        help='numbers of the channels to use, starting at 0. Default: all channels')
+    parser.add_argument('--glide', type=int, default=1, help='number of steps per block')
+    parser.add_argument('--average', type=int, default=20,
+                        help='length of the moving average and the median, center of mass of the exponential average')
+    parser.add_argument('--alpha-smoothing', choices=SMOOTHING_METHODS, default='average',
+                        help='smoothing of the alpha power')
+    parser.add_argument('--beta-smoothing', choices=SMOOTHING_METHODS, default='average',
+                        help='smoothing of the beta power')
+    parser.add_argument('--min-cutoff', type=float, default=1.0,
+                        help='cutoff frequency in Hz of the one euro filter at rest. Lower values smooth more')
+    parser.add_argument('--speed-coefficient', type=float, default=0.0,
+                        help='increase of the one euro cutoff per unit of power per sec. Higher values lag less')
+    for band in ('alpha', 'beta'):
+        parser.add_argument(f'--{band}-window', type=int,
+                            help=f'--average for the {band} power only')
+        parser.add_argument(f'--{band}-min-cutoff', type=float,
+                            help=f'--min-cutoff for the {band} power only')
+        parser.add_argument(f'--{band}-speed-coefficient', type=float,
+                            help=f'--speed-coefficient for the {band} power only')
+    parser.add_argument('--spectral', choices=['welch', 'sdft'], default='welch',
+                        help='spectral estimation: welch per block or sliding DFT')
+    parser.add_argument('--calibrate', action='store_true',
+                        help='record one minute of calibration data before processing')
+    parser.add_argument('--calibration-file',
+                        help='calibrate from the first minute of a recording (.mbr or csv with "# sfreq" as first line) instead')
+    parser.add_argument('--midi-port', type=int, default=1, help='number of the MIDI output port')
+    parser.add_argument('--alpha-cc', type=int, default=1, help='controller (or NRPN parameter) number for alpha power')
+    parser.add_argument('--beta-cc', type=int, default=2, help='controller (or NRPN parameter) number for beta power')
+    parser.add_argument('--alpha-channel', type=int, default=0, help='MIDI channel (0-15) for alpha power')
+    parser.add_argument('--beta-channel', type=int, default=0, help='MIDI channel (0-15) for beta power')
+    parser.add_argument('--resolution', choices=['7bit', '14bit', 'nrpn'], default='7bit',
+                        help='7 bit CC, 14 bit CC (controller numbers 0-31, LSB on number + 32) or 14 bit NRPN')
+    parser.add_argument('--midi-rate', type=float, default=100,
+                        help='maximum number of MIDI messages per second and controller')
+    parser.add_argument('--interpolation', choices=['none', 'linear', 'exponential'], default='none',
+                        help='ramps the controllers towards every new value with --midi-rate messages per second')
+    parser.add_argument('--metrics-file', help='file the stage timings and counters are written to every second')
+    parser.add_argument('--metrics-port', type=int,
+                        help='port on localhost where the stage timings and counters are served as text')
+    args = parser.parse_args(argv)
+    for band in ('alpha', 'beta'):
+        if not 0 <= getattr(args, f'{band}_channel') <= 15:
+            parser.error(f'--{band}-channel must be from 0 to 15')
+        max_cc, kind = MAX_CONTROL_NUMBERS[args.resolution]
+        if not 0 <= getattr(args, f'{band}_cc') <= max_cc:
+            parser.error(f'--{band}-cc must be from 0 to {max_cc} for {kind}')
+    return args
+
+
+def get_smoothing(args, band):
+    """
+    :param args: parsed arguments
+    :param band: 'alpha' or 'beta'
+    :return: smoothing method and parameters of the band, see Processing.set_smoothing.
+             Options given for the band take precedence over the ones for both bands
+    """
+    def band_arg(name, default):
+        value = getattr(args, f'{band}_{name}')
+        return default if value is None else value
+
+    method = SMOOTHING_METHODS[getattr(args, f'{band}_smoothing')]
+    params = dict(window=band_arg('window', args.average))
+    if method == SmoothingMethod.ONE_EURO:
+        params['min_cutoff'] = band_arg('min_cutoff', args.min_cutoff)
+        params['beta'] = band_arg('speed_coefficient', args.speed_coefficient)
+    return method, params
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    running = threading.Event()
+    running.set()
+    signal.signal(signal.SIGINT, lambda signum, frame: running.clear())
+    signal.signal(signal.SIGTERM, lambda signum, frame: running.clear())
+
+    midi.open_midi_port(args.midi_port)
+
+    proc = Processing()
+    proc.set_glide(args.glide)
+    proc.set_average(args.average)
+    for band in ('alpha', 'beta'):
+        method, params = get_smoothing(args, band)
+        proc.set_smoothing(band, method, **params)
+    if args.spectral == 'sdft':
+        proc.set_spectral_method(SpectralMethod.SLIDING_DFT)
+    if not proc.connect(args.host, args.port, running):
+        return
+
+    chans = np.arange(proc.n_channels) if args.channels is None else np.array(args.channels, dtype=int)
+    if args.calibration_file:
+        from playback import EEGPlayback
+        recording = EEGPlayback(args.calibration_file)
+        recording.load_data()
+        proc.cal_alpha = recording.get_calibration_data()
+        proc.cal_beta = proc.cal_alpha
+    proc.set_active_channels(chans)
+    if args.calibrate:
+        print('calibrating for one minute...')
+        if not proc.calibrate(True, True, running):
+            proc.disconnect()
+            return
+    print(f'[calibration] alpha: {proc.alpha_min} - {proc.alpha_max} beta: {proc.beta_min} - {proc.beta_max}')
+
+    interpolation = {'none': Interpolation.NONE, 'linear': Interpolation.LINEAR,
+                     'exponential': Interpolation.EXPONENTIAL}[args.interpolation]
+    resolution = {'7bit': midi.Resolution.CC_7BIT, '14bit': midi.Resolution.CC_14BIT,
+                  'nrpn': midi.Resolution.NRPN}[args.resolution]
+    midi_output = MidiOutput(proc, {'alpha': args.alpha_cc, 'beta': args.beta_cc}, args.midi_rate,
+                             interpolation, {'alpha': args.alpha_channel, 'beta': args.beta_channel},
+                             resolution).start()
+    proc.new_values_event.on_change += midi_output.put
+    exporter = None
+    if args.metrics_file or args.metrics_port is not None:
+        exporter = MetricsExporter(proc.metrics, args.metrics_file, args.metrics_port).start()
+    proc.start_processing(running)
+    midi_output.stop()
+    proc.disconnect()
+    if exporter is not None:
+        exporter.stop()
+    print(proc.metrics.format_status(('fetch', 'spectral', 'smoothing', 'midi', 'output')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import bisect
+import collections
+import math
+
+import numpy as np
+
+"""
+Streaming smoothers for the band powers. A smoother takes one raw value per processing step and returns
+the smoothed one. Processing creates one smoother per band, with the method and parameters set for that band
+Author: Edward Berndt
+"""
+
+
+class SmoothingMethod:
+    MOVING_AVERAGE = 0  # mean of the last `window` values
+    EXPONENTIAL = 1  # exponential moving average with the same center of mass as a moving average over `window`
+    MEDIAN = 2  # median of the last `window` values, ignores single outliers
+    ONE_EURO = 3  # low-pass that follows fast changes with less lag and smooths slow ones more, see OneEuroFilter
+
+
+class Smoother:
+    """
+    Base class of the smoothers
+    """
+
+    def update(self, x):
+        """
+        :param x: the newest raw value
+        :return: the smoothed value
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    def filter(self, values):
+        """
+        smooths consecutive values, continuing from the current state
+        :param values: array with consecutive raw values
+        :return: array with the smoothed value of every value, as update would have returned them
+        """
+        return np.array([self.update(x) for x in values], dtype=float)
+
+
+class MovingAverage(Smoother):
+    """
+    Mean of the last `window` values from a running sum. The sum is recomputed from the kept values once per
+    window, so rounding errors, e.g. after a large outlier has left the window, cannot accumulate.
+    """
+
+    def __init__(self, window=20):
+        self.window = max(int(window), 1)
+        self.reset()
+
+    def reset(self):
+        self._values = collections.deque(maxlen=self.window)
+        self._sum = 0.0
+        self._n_updates = 0
+
+    def update(self, x):
+        if len(self._values) == self.window:
+            self._sum -= self._values[0]
+        self._values.append(x)
+        self._sum += x
+        self._n_updates += 1
+        if self._n_updates % self.window == 0:
+            self._sum = math.fsum(self._values)
+        return self._sum / len(self._values)
+
+
+class ExponentialAverage(Smoother):
+    """
+    Exponential moving average. The first value is taken as it is
+    """
+
+    def __init__(self, window=20, alpha=None):
+        """
+        :param window: length of the moving average with the same center of mass, alpha = 2 / (window + 1)
+        :param alpha: weight of the newest value from 0 to 1. If given, window is ignored
+        """
+        self.alpha = alpha if alpha is not None else 2 / (max(window, 1) + 1)
+        self.reset()
+
+    def reset(self):
+        self._value = None
+
+    def update(self, x):
+        if self._value is None:
+            self._value = x
+        else:
+            self._value += self.alpha * (x - self._value)
+        return self._value
+
+
+class RunningMedian(Smoother):
+    """
+    Median of the last `window` values. The values are kept sorted, so every update costs a binary search
+    and moving at most `window` values, independent of the session length
+    """
+
+    def __init__(self, window=20):
+        self.window = max(int(window), 1)
+        self.reset()
+
+    def reset(self):
+        self._values = collections.deque()
+        self._sorted = []
+
+    def update(self, x):
+        if len(self._values) == self.window:
+            del self._sorted[bisect.bisect_left(self._sorted, self._values.popleft())]
+        self._values.append(x)
+        bisect.insort(self._sorted, x)
+        n = len(self._sorted)
+        if n % 2 == 1:
+            return self._sorted[n // 2]
+        return (self._sorted[n // 2 - 1] + self._sorted[n // 2]) / 2
+
+
+class OneEuroFilter(Smoother):
+    """
+    One euro filter (Casiez et al., 2012): a first order low-pass whose cutoff frequency rises with the speed of
+    the signal. Slow changes get smoothed strongly, fast changes pass with little lag.
+    The speed is given in units of the values per sec, so beta depends on the scale of the band powers
+    """
+
+    def __init__(self, rate, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        """
+        :param rate: number of values per sec
+        :param min_cutoff: cutoff frequency in Hz at rest. Lower values smooth more
+        :param beta: increase of the cutoff frequency per unit of speed. Higher values lag less on fast changes
+        :param d_cutoff: cutoff frequency in Hz of the low-pass on the speed
+        """
+        self.rate = rate
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self._value = None
+        self._speed = 0.0
+
+    def _alpha(self, cutoff):
+        tau = 1 / (2 * math.pi * cutoff)
+        return 1 / (1 + tau * self.rate)
+
+    def update(self, x):
+        if self._value is None:
+            self._value = x
+            return x
+        speed = (x - self._value) * self.rate
+        self._speed += self._alpha(self.d_cutoff) * (speed - self._speed)
+        cutoff = self.min_cutoff + self.beta * abs(self._speed)
+        self._value += self._alpha(cutoff) * (x - self._value)
+        return self._value
+
+
+def create_smoother(method, window=20, rate=1.0, **params):
+    """
+    :param method: see SmoothingMethod
+    :param window: number of values of the moving average and the median, center of mass of the exponential average
+    :param rate: number of values per sec, used by the one euro filter
+    :param params: further parameters of the smoother, e.g. min_cutoff and beta of the one euro filter
+    :return: a new Smoother
+    """
+    if method == SmoothingMethod.EXPONENTIAL:
+        return ExponentialAverage(window, **params)
+    if method == SmoothingMethod.MEDIAN:
+        return RunningMedian(window)
+    if method == SmoothingMethod.ONE_EURO:
+        return OneEuroFilter(rate, **params)
+    return MovingAverage(window)
@@ -0,0 +1,139 @@
+import numpy as np
+from scipy.integrate import simpson
+
+"""
+Author: Edward Berndt
+"""
+
+
+class SpectralMethod:
+    WELCH = 0
+    SLIDING_DFT = 1
+
+
+def band_weights(sfreq, n, lo, up):
+    """
+    weight vector for integrating a one-sided spectrum of n samples over the band from lo to up
+    :param sfreq: sampling frequency
+    :param n: number of samples the spectrum was calculated from
+    :param lo: lower limit of the band
+    :param up: upper limit of the band
+    :return: array with n // 2 + 1 weights, so that weights @ psd equals the simpson integral of psd within the band
+    """
+    freqs = np.fft.rfftfreq(int(n), 1.0 / sfreq)
+    band = np.flatnonzero(np.logical_and(freqs >= lo, freqs <= up))
+    weights = np.zeros(freqs.size)
+    if band.size > 0:
+        weights[band] = simpson(y=np.eye(band.size), dx=n / sfreq, axis=0)
+    return weights
+
+
+class SlidingDFT:
+    """
+    Incremental spectral estimation over a sliding window of n samples.
+    Only the DFT bins needed for the given bands are kept and updated as new samples arrive,
+    so a step of m samples costs O(m * bins * channels) instead of a full Welch call per channel.
+
+    The band powers equal those of Processing.get_band_power (scipy.signal.welch with nperseg=n,
+    i.e. periodic hann window, constant detrend and density scaling, integrated with simpson)
+    within a relative tolerance of 1e-9 for float64 data (1e-6 for float32 data, which welch processes
+    in single precision). The hann window is applied in the frequency domain,
+    rounding errors of the recursion are removed by recomputing the bins from the stored window
+    every `resync` windows.
+    """
+
+    def __init__(self, sfreq, n, n_channels, bands, resync=16):
+        """
+        :param sfreq: sampling frequency
+        :param n: window length in samples
+        :param n_channels: number of channels
+        :param bands: list of (lo, up) tuples with the limits of each band
+        :param resync: number of windows after which the bins are recomputed from scratch
+        """
+        self.sfreq = sfreq
+        self.n = int(n)
+        self.n_channels = int(n_channels)
+        self.resync = resync
+
+        freqs = np.fft.rfftfreq(self.n, 1.0 / sfreq)
+        band_bins = []
+        for lo, up in bands:
+            band_bins.append(np.flatnonzero(np.logical_and(freqs >= lo, freqs <= up)))
+
+        # every band bin needs its two neighbours for the hann window
+        needed = np.concatenate([np.concatenate((b - 1, b, b + 1)) for b in band_bins])
+        self._bins = np.unique(needed % self.n)
+        self._rot = np.exp(2j * np.pi * self._bins / self.n)
+        self._dft = np.exp(-2j * np.pi * np.outer(self._bins, np.arange(self.n)) / self.n)
+        self._dc = self._bins == 0
+        self._twiddles = dict()
+
+        # scaling of welch with density scaling and the periodic hann window (sum of w^2 = 3n/8)
+        scale = 1.0 / (sfreq * 3.0 * self.n / 8.0)
+        self._bands = []
+        for b, (lo, up) in zip(band_bins, bands):
+            one_sided = np.where(np.logical_or(b == 0, 2 * b == self.n), 1.0, 2.0)
+            weights = band_weights(sfreq, self.n, lo, up)[b]
+            self._bands.append((np.searchsorted(self._bins, b),
+                                np.searchsorted(self._bins, (b - 1) % self.n),
+                                np.searchsorted(self._bins, (b + 1) % self.n),
+                                scale * one_sided,
+                                weights))
+        self.reset()
+
+    def reset(self):
+        self._window = np.zeros((self.n, self.n_channels))
+        self._pos = 0
+        self._since_sync = 0
+        self._X = np.zeros((self._bins.size, self.n_channels), dtype=complex)
+
+    def push(self, new_samples):
+        """
+        moves the window by the given samples and updates the tracked bins
+        :param new_samples: array of shape (samples, channels), oldest sample first
+        :return:
+        """
+        m = len(new_samples)
+        if m == 0:
+            return
+        if m >= self.n:
+            self._window[:] = new_samples[-self.n:, :]
+            self._pos = 0
+            self._resync()
+            return
+
+        idx = (self._pos + np.arange(m)) % self.n
+        diff = new_samples - self._window[idx, :]
+        self._window[idx, :] = new_samples
+        self._pos = (self._pos + m) % self.n
+        self._X = self._rot[:, None] ** m * self._X + self._get_twiddle(m) @ diff
+        self._since_sync += m
+        if self._since_sync >= self.resync * self.n:
+            self._resync()
+
+    def band_powers(self):
+        """
+        :return: array of shape (bands, channels) with the power of each band for every channel
+        """
+        X = self._X
+        if self._dc.any():
+            # constant detrend: the mean of the window only shows up in bin 0
+            X = X.copy()
+            X[self._dc] = 0
+        powers = np.empty((len(self._bands), self.n_channels))
+        for i, (k, k_lo, k_up, scale, weights) in enumerate(self._bands):
+            windowed = 0.5 * X[k] - 0.25 * X[k_lo] - 0.25 * X[k_up]
+            psd = scale[:, None] * np.abs(windowed) ** 2
+            powers[i] = weights @ psd
+        return powers
+
+    def _resync(self):
+        window = np.roll(self._window, -self._pos, axis=0)
+        self._X = self._dft @ window
+        self._since_sync = 0
+
+    def _get_twiddle(self, m):
+        # contribution of the j-th new sample after the window has been moved by m samples
+        if m not in self._twiddles:
+            self._twiddles[m] = np.exp(2j * np.pi * np.outer(self._bins, m - np.arange(m)) / self.n)
+        return self._twiddles[m]
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import FieldTrip
+from FieldTripServer import BufferServer
+from Processing import Processing, ConnectionStatus
+
+
+def wait_until(condition, timeout=10.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_buffer_restart_during_header_wait():
+    server = BufferServer(port=0).start()
+    port = server.port
+    proc = Processing()
+    proc.connection.max_delay = 0.2
+    running = threading.Event()
+    running.set()
+    thread = threading.Thread(target=proc.connect, args=('localhost', port, running), daemon=True)
+    thread.start()
+    try:
+        assert wait_until(lambda: proc.connection_status == ConnectionStatus.WAIT_FOR_HEADER)
+        server.stop()
+        server = BufferServer(port=port).start()
+        client = FieldTrip.Client()
+        client.connect('localhost', port)
+        client.putHeader(4, 256.0, FieldTrip.DATATYPE_FLOAT32)
+        client.disconnect()
+
+        assert wait_until(lambda: proc.connection_status == ConnectionStatus.CONNECTED)
+        assert proc.connection.client.isConnected
+        assert proc.n_channels == 4 and proc.sfreq == 256.0
+    finally:
+        running.clear()
+        thread.join(5)
+        proc.disconnect()
+        server.stop()
+
+
+def put_header(port, n_channels, sfreq=256.0):
+    client = FieldTrip.Client()
+    client.connect('localhost', port)
+    client.putHeader(n_channels, sfreq, FieldTrip.DATATYPE_FLOAT32)
+    client.disconnect()
+
+
+def test_new_header_stops_recording(tmp_path):
+    server = BufferServer(port=0).start()
+    port = server.port
+    put_header(port, 4)
+    proc = Processing()
+    proc.connection.max_delay = 0.2
+    stopped = []
+    proc.recording_stopped.on_change += stopped.append
+    running = threading.Event()
+    running.set()
+    assert proc.connect('localhost', port, running)
+    path = str(tmp_path / 'session.mbr')
+    proc.start_recording(path)
+    thread = threading.Thread(target=proc.start_processing, args=(running,), daemon=True)
+    thread.start()
+    try:
+        server.stop()
+        server = BufferServer(port=port).start()
+        put_header(port, 8)
+        assert wait_until(lambda: stopped)
+        assert stopped == [path]
+        assert proc.recorder is None
+        assert proc.n_channels == 8
+    finally:
+        running.clear()
+        thread.join(5)
+        proc.disconnect()
+        server.stop()
@@ -0,0 +1,44 @@
+import pytest
+
+midi = pytest.importorskip('midi', exc_type=ImportError)
+
+
+def test_messages_at_the_largest_numbers():
+    assert midi.control_change(127, 127, 15) == [0xBF, 127, 127]
+    assert midi.control_change_14bit(16383, 31) == [[0xB0, 31, 127], [0xB0, 63, 127]]
+    assert midi.nrpn(16383, 16383, 15) == [[0xBF, 99, 127], [0xBF, 98, 127], [0xBF, 6, 127], [0xBF, 38, 127]]
+
+
+@pytest.mark.parametrize('create', [
+    lambda: midi.control_change(1, 1, 16),
+    lambda: midi.control_change(1, 128),
+    lambda: midi.control_change_14bit(1, 32),
+    lambda: midi.control_change_14bit(16384, 1),
+    lambda: midi.nrpn(1, 16384),
+    lambda: midi.nrpn(-1, 1),
+])
+def test_out_of_range_raises(create):
+    with pytest.raises(ValueError):
+        create()
+
+
+def test_empty_range_scales_to_the_middle():
+    assert midi.scale(3.0, 2.0, 2.0) == 0.5
+    assert midi.to_midi(3.0, 2.0, 2.0) == 63
+
+
+def test_output_survives_a_bad_value(monkeypatch):
+    from midioutput import MidiOutput
+    from Processing import Processing, PowerValues
+    from test_connection import wait_until
+
+    sent = []
+    monkeypatch.setattr(midi, 'send_messages', sent.extend)
+    output = MidiOutput(Processing(), {'alpha': 1}).start()
+    try:
+        output.put(PowerValues(av_alpha=float('nan')))
+        assert wait_until(lambda: output.processing.metrics.counters.get('midi_errors') == 1)
+        output.put(PowerValues(av_alpha=0.5))
+        assert wait_until(lambda: sent == [[0xB0, 1, 63]])
+    finally:
+        output.stop()
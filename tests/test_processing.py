@@ -0,0 +1,75 @@
+import threading
+
+import numpy as np
+
+import FieldTrip
+from FieldTripServer import BufferServer
+from Processing import Processing
+from spectral import SpectralMethod
+
+from test_connection import wait_until
+
+
+def test_recording_matches_live_processing():
+    # 128 samples per block are not divisible by a glide of 3, so every step is int(128 / 3) samples
+    sfreq, n_channels, glide = 128, 2, 3
+    data = np.random.default_rng(0).standard_normal((20 * sfreq, n_channels)).astype(np.float32)
+    server = BufferServer(port=0).start()
+    client = FieldTrip.Client()
+    client.connect('localhost', server.port)
+    client.putHeader(n_channels, float(sfreq), FieldTrip.DATATYPE_FLOAT32)
+    proc = Processing()
+    running = threading.Event()
+    running.set()
+    assert proc.connect('localhost', server.port, running)
+    proc.set_glide(glide)
+    proc.set_active_channels(np.arange(n_channels))
+    live = []
+    proc.new_values_event.on_change += live.append
+    # the processing starts at the latest sample, so the data is only put once it has started
+    started = threading.Event()
+    set_latest_sample = proc.set_latest_sample
+    proc.set_latest_sample = lambda: (set_latest_sample(), started.set())
+    thread = threading.Thread(target=proc.start_processing, args=(running,), daemon=True)
+    thread.start()
+    try:
+        assert started.wait(5)
+        for i in range(0, len(data), 64):
+            client.putData(data[i:i + 64])
+        n_expected = len(proc.get_window_starts(len(data)))
+        assert wait_until(lambda: len(live) == n_expected)
+    finally:
+        running.clear()
+        thread.join(5)
+        client.disconnect()
+        proc.disconnect()
+        server.stop()
+
+    offline = Processing()
+    offline.sfreq = offline.block_size = sfreq
+    offline.n_channels = n_channels
+    offline.set_glide(glide)
+    offline.set_active_channels(np.arange(n_channels))
+    values = offline.process_recording(data)
+    assert len(values) == len(live) == (len(data) - sfreq) // (sfreq // glide) + 1
+    np.testing.assert_allclose(values.raw_alpha, [v.raw_alpha for v in live], rtol=1e-6)
+    np.testing.assert_allclose(values.av_beta, [v.av_beta for v in live], rtol=1e-6)
+
+
+def test_switch_to_sliding_dft_while_running():
+    sfreq, n_channels = 128, 2
+    data = np.random.default_rng(1).standard_normal((3 * sfreq, n_channels))
+    proc = Processing()
+    proc.sfreq = proc.block_size = sfreq
+    proc.n_channels = n_channels
+    proc.reset_raw_data()
+    proc.raw_data.append(data[:300])
+    proc.set_spectral_method(SpectralMethod.SLIDING_DFT)
+    sdft = proc.get_sliding_dft()
+    assert sdft is not None
+    reference = proc.create_sliding_dft()
+    reference.push(data[300 - sfreq:300])
+    np.testing.assert_allclose(sdft.band_powers(), reference.band_powers())
+
+    proc.set_spectral_method(SpectralMethod.WELCH)
+    assert proc.get_sliding_dft() is None
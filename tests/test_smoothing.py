@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from Processing import Processing
+from smoothing import SmoothingMethod
+
+
+def create_processing(alpha_params, beta_params):
+    proc = Processing()
+    proc.sfreq = 256
+    proc.block_size = 256
+    for band, params in (('alpha', alpha_params), ('beta', beta_params)):
+        proc.set_smoothing(band, SmoothingMethod.ONE_EURO, **params)
+    return proc
+
+
+def smooth(proc, values):
+    smoothers = proc.create_smoothers()
+    return smoothers['alpha'].filter(values), smoothers['beta'].filter(values)
+
+
+def test_bands_are_smoothed_with_their_own_parameters():
+    values = np.random.default_rng(0).normal(1.0, 0.2, 200)
+    alpha, beta = smooth(create_processing(dict(min_cutoff=0.1), dict(min_cutoff=5.0)), values)
+    assert not np.allclose(alpha, beta)
+    # the band with the lower cutoff gets smoothed more
+    assert np.std(np.diff(alpha)) < np.std(np.diff(beta))
+
+    alpha, beta = smooth(create_processing(dict(min_cutoff=1.0), dict(min_cutoff=1.0)), values)
+    np.testing.assert_array_equal(alpha, beta)
+
+
+def test_window_of_a_band_replaces_the_average():
+    proc = Processing()
+    proc.set_average(20)
+    proc.set_smoothing('beta', SmoothingMethod.MOVING_AVERAGE, window=5)
+    smoothers = proc.create_smoothers()
+    assert smoothers['alpha'].window == 20
+    assert smoothers['beta'].window == 5
+
+
+def test_run_options_per_band():
+    run = pytest.importorskip('run', exc_type=ImportError)
+    args = run.parse_args(['--alpha-smoothing', 'one-euro', '--beta-smoothing', 'one-euro', '--min-cutoff', '2',
+                           '--alpha-min-cutoff', '0.5', '--beta-speed-coefficient', '0.1', '--beta-window', '8'])
+    assert run.get_smoothing(args, 'alpha') == (SmoothingMethod.ONE_EURO,
+                                                dict(window=20, min_cutoff=0.5, beta=0.0))
+    assert run.get_smoothing(args, 'beta') == (SmoothingMethod.ONE_EURO,
+                                               dict(window=8, min_cutoff=2.0, beta=0.1))